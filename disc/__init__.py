@@ -1,15 +1,54 @@
-import os
-
 from dotenv import load_dotenv
 
+from settings import Settings
+
 load_dotenv()
 
-DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
-HOCKEYDATA_HOST = os.getenv("HOCKEYDATA_HOST")
-HOCKEYDATA_API_KEY = os.getenv("HOCKEYDATA_API_KEY")
-HOCKEYDATA_TEAM_NAME = os.getenv("HOCKEYDATA_TEAM_NAME").split(",")
-DISPLAYED_TEAM_NAME = os.getenv("DISPLAYED_TEAM_NAME")
-DISPLAY_TEAM_NAME_POSSESSIVE = (
-    f"{DISPLAYED_TEAM_NAME}'s" if DISPLAYED_TEAM_NAME[-1] != "s" else f"{DISPLAYED_TEAM_NAME}'"
-)
-LANGUAGE = os.getenv("LANGUAGE", "en")
+# Read once here and validated when the bot starts (see main.py), so importing never fails on a bad configuration
+settings = Settings.from_env()
+
+# The settings are also available by name, since some are needed at import (e.g. for the intervals of loops)
+DISCORD_TOKEN = settings.discord_token
+HOCKEYDATA_HOST = settings.hockeydata_host
+HOCKEYDATA_API_KEY = settings.hockeydata_api_key
+HOCKEYDATA_STREAM_URL = settings.hockeydata_stream_url
+HOCKEYDATA_TEAM_NAME = settings.hockeydata_team_name
+DISPLAYED_TEAM_NAME = settings.displayed_team_name
+TEAM_KEY = settings.team_key
+TEAMS_FILE = settings.teams_file
+LANGUAGE = settings.language
+DELIVERY_CONCURRENCY = settings.delivery_concurrency
+IMAGE_WORKERS = settings.image_workers
+# Megabytes of memory for the responses and prepared cards, the resized images and the last response of every polled
+# endpoint. The least recently used entries are dropped when a cache is full.
+RESPONSE_CACHE_MB = settings.response_cache_mb
+IMAGE_CACHE_MB = settings.image_cache_mb
+HOCKEYDATA_CACHE_MB = settings.hockeydata_cache_mb
+
+# "all" polls and delivers in one process, "poller" only polls and writes events to the event log, "worker" only
+# delivers events from the log to the channels in the guilds of its shards
+ROLE = settings.role
+SHARD_COUNT = settings.shard_count
+# Comma separated shard ids and ranges (e.g. "0-3,8"), all shards are run by this process if it isn't set
+SHARD_IDS = settings.shard_ids
+EVENT_LOG_INTERVAL = settings.event_log_interval
+# Seconds between edits of the live cards, everything that happens in between is shown in a single edit
+LIVE_CARD_INTERVAL = settings.live_card_interval
+# Replicas sharing the data directory elect a leader, which polls and delivers while the others wait as standbys.
+# A leader that stops renewing its lease is replaced after LEASE_DURATION seconds, one that shuts down right away.
+LEADER_ELECTION = settings.leader_election
+LEASE_DURATION = settings.lease_duration
+
+# Metrics are served in the Prometheus format on http://METRICS_HOST:METRICS_PORT/metrics if the port is set
+METRICS_HOST = settings.metrics_host
+METRICS_PORT = settings.metrics_port
+METRICS_TRACE_FILE = settings.metrics_trace_file
+
+# Every HockeyData response is appended to this file to be replayed later with tools/replay.py, if it is set
+HOCKEYDATA_RECORD_FILE = settings.hockeydata_record_file
+
+# Seconds between polls in each phase of a match
+POLL_INTERVALS = settings.poll_intervals
+POLL_PRE_MATCH_LEAD = settings.poll_pre_match_lead
+POLL_INTERMISSION_AFTER = settings.poll_intermission_after
+POLL_MAX_BACKOFF = settings.poll_max_backoff
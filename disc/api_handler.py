@@ -1,84 +1,230 @@
-import json
-import os
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from datetime import datetime
 from io import BytesIO
-from typing import Union
-
-import cachetools.func
-import discord
-import requests
-from PIL import Image
-
-from __init__ import (
-    HOCKEYDATA_API_KEY,
-    HOCKEYDATA_TEAM_NAME,
-    DISPLAYED_TEAM_NAME,
-    DISPLAY_TEAM_NAME_POSSESSIVE,
+from typing import Awaitable, Hashable, Optional
+
+import aiohttp
+
+import memory
+import metrics
+from __init__ import HOCKEYDATA_CACHE_MB, HOCKEYDATA_RECORD_FILE, IMAGE_CACHE_MB, IMAGE_WORKERS, RESPONSE_CACHE_MB
+from cache import ResponseCache
+from hockeydata import HockeyDataClient, HockeyDataResponse
+from image_cache import CachedImage, ImageCache
+from manifest import CACHE_POLICIES, ENDPOINTS, GLOBAL_MESSAGES, MATCH_ENDPOINTS
+from match_state import MatchState
+from models import Attachment, DiscEmbed, DiscException, MatchStatus
+from recorder import Recorder
+from teams import TEAMS, Team
+
+# The api keys are left out of the recording, it only needs to know which responses belong to which team
+_recorder = (
+    Recorder(
+        HOCKEYDATA_RECORD_FILE,
+        {
+            "teams": [
+                {
+                    "key": team.key,
+                    "hockeydata_names": team.hockeydata_names,
+                    "displayed_name": team.displayed_name,
+                    "host": team.host,
+                }
+                for team in TEAMS.values()
+            ]
+        },
+    )
+    if HOCKEYDATA_RECORD_FILE
+    else None
+)
+MB = 1024 * 1024
+client = HockeyDataClient(recorder=_recorder, max_bytes=int(HOCKEYDATA_CACHE_MB * MB))
+responses = ResponseCache(max_bytes=int(RESPONSE_CACHE_MB * MB))
+images = ImageCache(max_bytes=int(IMAGE_CACHE_MB * MB))
+states = {team.key: MatchState(team) for team in TEAMS.values()}
+# Pillow releases the GIL while resizing and encoding, so threads are enough to keep it off the event loop
+_image_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+_background_tasks = set()
+
+metrics.RESPONSE_CACHE.collect = lambda: {(result,): count for result, count in responses.stats.items()}
+metrics.RESPONSE_CACHE_HIT_RATIO.collect = lambda: {(): responses.hit_ratio}
+memory.caches.update(
+    responses=lambda: responses.nbytes,
+    images=lambda: images.nbytes,
+    hockeydata=lambda: client.nbytes,
 )
-from manifest import ENDPOINTS, GLOBAL_MESSAGES
-from models import DiscEmbed, DiscException, MatchStatus
+metrics.CACHE_BYTES.collect = lambda: {(name,): size() for name, size in memory.caches.items()}
+metrics.RESIDENT_MEMORY.collect = lambda: {(): memory.rss_bytes()}
+
+
+def _cache_key(team: Team, name: str, endpoint: str) -> Hashable:
+    match_key = states[team.key].match_key
+    if name in MATCH_ENDPOINTS and match_key:
+        # Teams playing each other get the same live data, so it's only fetched once for all of them
+        return match_key, name
+    return endpoint
 
 
-@cachetools.func.ttl_cache(ttl=15)
-def query(endpoint: str, as_json: bool = True) -> Union[dict, requests.Response]:
+async def _request(name: str, request: Awaitable[HockeyDataResponse]) -> HockeyDataResponse:
     try:
-        r = requests.get(endpoint, headers={"HockeyData-API-Key": HOCKEYDATA_API_KEY})
-        r.raise_for_status()
-        if as_json:
-            return r.json()
-        return r
-    except requests.exceptions.RequestException as e:
-        print(e)
+        with metrics.HOCKEYDATA_LATENCY.time(name):
+            return await request
+    except Exception:
+        metrics.HOCKEYDATA_ERRORS.inc(name)
+        raise
+
+
+async def _poll(team: Team, name: str, **params) -> Optional[HockeyDataResponse]:
+    endpoint = ENDPOINTS[name].format(host=team.host, **params)
+    key = _cache_key(team, name, endpoint)
+    try:
+        return await responses.get(
+            key, lambda: _request(name, client.poll(endpoint, team.api_key)), CACHE_POLICIES[name]
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"{endpoint}: {e!r}")
+        return None
+
+
+def feed(team: Team, name: str, body: bytes) -> None:
+    """Handle a payload pushed by the live stream as if it was just polled"""
+    endpoint = ENDPOINTS[name].format(host=team.host)
+    responses.put(_cache_key(team, name, endpoint), client.prime(endpoint, body), CACHE_POLICIES[name])
+
+
+async def query(team: Team, name: str, as_json: bool = True, **params) -> dict | bytes:
+    r = await _poll(team, name, **params)
+    if r is None:
+        return {}
+    if not as_json:
+        return r.body
+    try:
+        return r.json()
+    except ValueError as e:
+        print(f"{name}: {e!r}")
         return {}
 
 
-def _convert_to_discord_file(image_bytes: bytes, size: tuple[int, int], filename: str) -> discord.File:
+def _convert_image(image_bytes: bytes, size: tuple[int, int]) -> bytes:
     """Resize an image in bytes"""
-    image = Image.open(BytesIO(image_bytes))
-    image.thumbnail(size, resample=Image.Resampling.LANCZOS)
+    # Pillow is only imported once the first image is converted, it's slow to import and most processes never need it
+    from PIL import Image
 
-    with BytesIO() as output:
-        image.save(output, format="webp")
-        output.seek(0)
-        return discord.File(output, filename=filename)
+    with metrics.IMAGE_CONVERT.time():
+        image = Image.open(BytesIO(image_bytes))
+        image.thumbnail(size, resample=Image.Resampling.LANCZOS)
 
+        with BytesIO() as output:
+            image.save(output, format="webp")
+            return output.getvalue()
 
-def get_team_image(team_name: str = DISPLAYED_TEAM_NAME) -> discord.File:
-    """Get the image of the team"""
-    r = query(ENDPOINTS["team_image"].format(team_name=team_name), as_json=False)
-    if not r:
+
+async def _load_image(team: Team, name: str, endpoint: str, key: tuple, size: tuple[int, int], max_age: float) -> bytes:
+    """Get a resized image from the image cache, only downloading and converting it again if it has changed"""
+    cached = await images.get(key)
+    if cached and cached.is_fresh(max_age):
+        return cached.data
+
+    try:
+        if cached:
+            request = client.fetch(endpoint, team.api_key, etag=cached.etag, last_modified=cached.last_modified)
+        else:
+            request = client.fetch(endpoint, team.api_key)
+        r = await _request(name, request)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"{endpoint}: {e!r}")
+        # An outdated image is better than no image
+        if cached:
+            return cached.data
         raise DiscException("No image found")
-    return _convert_to_discord_file(r.content, (512, 512), f"{team_name}.webp")
 
+    if r.not_modified and cached:
+        await images.put(key, replace(cached, validated_at=time.time()))
+        return cached.data
 
-def get_player_image(player_id: int, image_type: str = "") -> discord.File:
-    """Get the image URL of a player"""
-    r = query(ENDPOINTS["player_image"].format(player_id=player_id, image_type=image_type), as_json=False)
-    if not r:
+    if not r.body:
         raise DiscException("No image found")
-    return _convert_to_discord_file(r.content, (800, 800), f"{player_id}.webp")
+    data = await asyncio.get_running_loop().run_in_executor(_image_pool, _convert_image, r.body, size)
+    await images.put(key, CachedImage(data=data, etag=r.etag, last_modified=r.last_modified, validated_at=time.time()))
+    return data
+
+
+async def _get_image(team: Team, name: str, key: tuple, size: tuple[int, int], **params) -> bytes:
+    endpoint = ENDPOINTS[name].format(host=team.host, **params)
+    policy = CACHE_POLICIES[name]
+    return await responses.get(key, lambda: _load_image(team, name, endpoint, key, size, policy.ttl), policy)
+
+
+async def get_team_image(team: Team, team_name: Optional[str] = None) -> Attachment:
+    """Get the image of the team (or another team by name)"""
+    team_name = team_name or team.displayed_name
+    size = (512, 512)
+    data = await _get_image(team, "team_image", ("team", team_name, "logo", size), size, team_name=team_name)
+    return Attachment(filename=f"{team_name}.webp", data=data)
+
+
+async def get_player_image(team: Team, player_id: int, image_type: str = "") -> Attachment:
+    """Get the image URL of a player"""
+    size = (800, 800)
+    key = ("player", player_id, image_type, size)
+    data = await _get_image(team, "player_image", key, size, player_id=player_id, image_type=image_type)
+    return Attachment(filename=f"{player_id}.webp", data=data)
+
+
+async def prewarm_images(team: Team, match: dict) -> None:
+    """Prepare the team logos and the images of recent goal scorers before they are needed in an embed"""
+    is_home = match["homeTeam"]["fullName"] in team.hockeydata_names
+    opponent = match["awayTeam"]["fullName"] if is_home else match["homeTeam"]["fullName"]
+    results = await asyncio.gather(
+        get_team_image(team),
+        get_team_image(team, opponent),
+        *(get_player_image(team, player_id, image_type="goal") for player_id in states[team.key].scorers),
+        return_exceptions=True,
+    )
+    failed = sum(isinstance(result, Exception) for result in results)
+    if failed:
+        print(f"Failed to prepare {failed} of {len(results)} images")
+
 
+def _schedule(work: Awaitable) -> None:
+    task = asyncio.create_task(work)
+    # Keep a reference until it's done, otherwise the task can be garbage collected while running
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
-def get_match_status() -> DiscEmbed:
-    # TODO: Remove json file and use a database
-    if os.path.exists("data/match.json"):
-        with open("data/match.json", encoding="utf-8") as f:
-            old_status = json.load(f)
-    else:
-        old_status = {"status": MatchStatus.Scheduled.value}
 
-    r = query(ENDPOINTS["status"])
+async def close() -> None:
+    await client.close()
+    _image_pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def get_match_status(team: Team) -> DiscEmbed:
+    state = states[team.key]
+    response = await _poll(team, "status")
+    if response is None:
+        raise DiscException("No data")
+    # Nothing to do if the match hasn't changed since the last time it was handled
+    if not state.has_changed("status", response.digest):
+        return DiscEmbed(extra_data={"active_match": state.status == MatchStatus.InProgress.value})
+
+    r = await query(team, "status")
     if not r:
         raise DiscException("No data")
 
-    is_home = r["homeTeam"]["fullName"] in HOCKEYDATA_TEAM_NAME
+    is_home = r["homeTeam"]["fullName"] in team.hockeydata_names
+    state.match_key = (r["homeTeam"]["fullName"], r["awayTeam"]["fullName"], r.get("date"))
 
-    just_started = r["status"] == MatchStatus.InProgress.value and old_status["status"] == MatchStatus.Scheduled.value
-    just_ended = r["status"] == MatchStatus.Finished.value and old_status["status"] == MatchStatus.InProgress.value
+    just_started, just_ended = state.update_status(r["status"], r.get("date"))
+    if r["status"] == MatchStatus.Scheduled.value:
+        _schedule(prewarm_images(team, r))
+    # Prepared now that the match changed, so /next_match never has to wait for HockeyData or the logo
+    _schedule(refresh_next_match_card(team))
 
     values = {
         "opponent": r["awayTeam"]["fullName"] if is_home else r["homeTeam"]["fullName"],
-        "team": DISPLAYED_TEAM_NAME,
+        "team": team.displayed_name,
         "arena": r["venue"]["name"],
         "team_score": "Error",
         "opponent_score": "Error",
@@ -94,7 +240,7 @@ def get_match_status() -> DiscEmbed:
         disc_embed.title_key = "match_end_title"
         disc_embed.description_key = "match_end"
         disc_embed.hex_color = 0xFFA500
-        score = query(ENDPOINTS["score"])
+        score = await query(team, "score")
 
         if score:
             disc_embed.values["team_score"] = score["homeTeam"]["score"] if is_home else score["awayTeam"]["score"]
@@ -103,48 +249,81 @@ def get_match_status() -> DiscEmbed:
             if winner:
                 disc_embed.hex_color = 0x00FF00
                 disc_embed.description_key = "match_win"
-                disc_embed.thumbnail = get_team_image(values["team"])
+                disc_embed.thumbnail = await _image_or_none(get_team_image(team))
             else:
                 disc_embed.hex_color = 0xFF0000
                 disc_embed.description_key = "match_loss"
-                disc_embed.thumbnail = get_team_image(values["opponent"])
+                disc_embed.thumbnail = await _image_or_none(get_team_image(team, values["opponent"]))
 
     disc_embed.extra_data = {
         "active_match": r["status"] == MatchStatus.InProgress.value,
     }
 
-    with open("data/match.json", "w", encoding="utf-8") as f:
-        json.dump(r, f)
+    state.mark_handled("status", response.digest)
     return disc_embed
 
 
-def get_next_match() -> DiscEmbed:
+async def get_next_match(team: Team) -> DiscEmbed:
     """Get information about the next match"""
-    r = query(ENDPOINTS["status"])
+    r = await query(team, "status")
     if not r or not r["status"] == MatchStatus.Scheduled.value:
         raise DiscException
 
-    is_home = r["homeTeam"]["fullName"] in HOCKEYDATA_TEAM_NAME
+    is_home = r["homeTeam"]["fullName"] in team.hockeydata_names
     utc_date = datetime.fromisoformat(r["date"])
+    _schedule(prewarm_images(team, r))
 
     values = {
         "tournament_name": r["tournament"]["name"],
         "opponent": r["awayTeam"]["fullName"] if is_home else r["homeTeam"]["fullName"],
-        "team": DISPLAYED_TEAM_NAME,
+        "team": team.displayed_name,
         "arena": r["venue"]["name"],
         "timestamp": f"<t:{int(utc_date.timestamp())}:R>",
         "long_datetime": f"<t:{int(utc_date.timestamp())}:F>",
-        "team_possessive": DISPLAY_TEAM_NAME_POSSESSIVE,
+        "team_possessive": team.possessive,
     }
 
     return DiscEmbed(title_key="next_match_title", description_key="next_match", values=values, hex_color=0xFFA500)
 
 
-def _get_scorer_info() -> dict:
-    """Get information about the goalscorer and assists"""
-    r = query(ENDPOINTS["goal_scorer"])
+async def _load_next_match_card(team: Team) -> Optional[DiscEmbed]:
+    """The next match with the team logo, or None if no match is scheduled. It's rendered for every reply, only
+    filling in the messages."""
+    try:
+        card = await get_next_match(team)
+    except DiscException:
+        return None
+    card.thumbnail = await _image_or_none(get_team_image(team))
+    return card
+
+
+async def refresh_next_match_card(team: Team) -> None:
+    card = await _load_next_match_card(team)
+    responses.put(("next_match_card", team.key), card, CACHE_POLICIES["next_match_card"])
+
+
+def has_next_match_card(team: Team) -> bool:
+    """Whether get_next_match_card answers from memory"""
+    return ("next_match_card", team.key) in responses
+
+
+async def get_next_match_card(team: Team) -> Optional[DiscEmbed]:
+    """Get the prepared next match card, only waiting for HockeyData and the logo if it was never loaded"""
+    policy = CACHE_POLICIES["next_match_card"]
+    return await responses.get(("next_match_card", team.key), lambda: _load_next_match_card(team), policy)
+
+
+async def _get_scorer_info(team: Team) -> dict:
+    """Get information about the most recent goalscorer and assists, if they weren't used for an earlier goal"""
+    state = states[team.key]
+    response = await _poll(team, "goal_scorer")
+    # The scorer stats may be updated later than the score, the previous scorer shouldn't be credited for a new goal
+    if response is None or not state.has_changed("goal_scorer", response.digest):
+        return {}
+    r = await query(team, "goal_scorer")
     if not r:
         return {}
+    state.mark_handled("goal_scorer", response.digest)
 
     scorer = r["playerinfo"]["scorer"]
     assists = r["playerinfo"]["assists"]
@@ -163,83 +342,124 @@ def _get_scorer_info() -> dict:
     }
 
 
-def get_presence_string() -> str:
+async def get_presence_string(team: Team) -> str:
     """Get the presence string for the bot"""
-    r = query(ENDPOINTS["score"])
+    r = await query(team, "score")
     if not r:
         raise DiscException("No data")
 
-    is_home = r["homeTeam"]["team"] in HOCKEYDATA_TEAM_NAME
+    is_home = r["homeTeam"]["team"] in team.hockeydata_names
 
     values = {
         "team_score": r["homeTeam"]["score"] if is_home else r["awayTeam"]["score"],
         "opponent_score": r["awayTeam"]["score"] if is_home else r["homeTeam"]["score"],
         "opponent": r["awayTeam"]["team"] if is_home else r["homeTeam"]["team"],
-        "team": DISPLAYED_TEAM_NAME,
+        "team": team.displayed_name,
     }
 
     return GLOBAL_MESSAGES["presence"].format(**values)
 
 
-def get_goal() -> DiscEmbed:
-    """Get information about the goal and the scorer (if there was a goal)"""
-    # TODO: Remove json file and use a database
-    if os.path.exists("data/score.json"):
-        with open("data/score.json", encoding="utf-8") as f:
-            old_score = json.load(f)
-    else:
-        old_score = dict(
-            {
-                "team": {"score": 0, "team": DISPLAYED_TEAM_NAME},
-                "opponent": {"score": 0, "team": "Unknown"},
-            }
-        )
+async def get_live_card(team: Team) -> DiscEmbed:
+    """Get the scoreboard of the current match, which is edited in place in channels using live cards"""
+    state = states[team.key]
+    finished = state.status == MatchStatus.Finished.value
+    return DiscEmbed(
+        title_key="live_card_final_title" if finished else "live_card_title",
+        description_key="live_card",
+        values={
+            "team": team.displayed_name,
+            "score": await get_presence_string(team),
+        },
+        hex_color=0xFFA500 if finished else 0x00FF00,
+        # The logo is uploaded with the first message, edits keep referring to the same attachment
+        thumbnail=await _image_or_none(get_team_image(team)),
+        # The same for the whole match, so every update of the match goes to the same message
+        event_id=f"{team.key}:{state.start}:card",
+    )
+
+
+async def _image_or_none(image: Awaitable[Attachment]) -> Optional[Attachment]:
+    # The new status or score is already stored, so a missing image must not stop the message from being sent
+    try:
+        return await image
+    except DiscException:
+        return None
+
+
+async def get_goals(team: Team) -> list[DiscEmbed]:
+    """Get an embed for every goal since the last poll, in order, with the scorer on the newest goal of the team"""
+    state = states[team.key]
+    response = await _poll(team, "score")
+    if response is None:
+        raise DiscException("No data")
+    if not state.has_changed("score", response.digest):
+        return []
 
-    r = query(ENDPOINTS["score"])
+    r = await query(team, "score")
     if not r:
         raise DiscException("No data")
 
     home_team = r["homeTeam"]
     away_team = r["awayTeam"]
-    team_is_home = home_team["team"] in HOCKEYDATA_TEAM_NAME
-    team = home_team if team_is_home else away_team
+    team_is_home = home_team["team"] in team.hockeydata_names
+    our_team = home_team if team_is_home else away_team
     opponent = away_team if team_is_home else home_team
 
-    values = {
-        "home_team": r["homeTeam"],
-        "away_team": r["awayTeam"],
-        "team": DISPLAYED_TEAM_NAME,
-        "opponent": opponent["team"],
-        "team_score": team["score"],
-        "opponent_score": opponent["score"],
-    }
-
-    disc_embed = DiscEmbed(values=values)
-
-    if int(old_score["team"]["score"]) < int(team["score"]):
-        disc_embed.title_key = "goal_home_title"
-        disc_embed.description_key = "goal_home"
-        disc_embed.hex_color = 0x00FF00
-        disc_embed.thumbnail = get_team_image(values["team"])
-        scorer_info = _get_scorer_info()
-        if scorer_info:
-            disc_embed.appended_description = scorer_info["appended_description"]
-            # Overwrite the thumbnail with the player image if there is one
-            try:
-                disc_embed.thumbnail = get_player_image(scorer_info["player_id"], image_type="goal")
-            except DiscException:
-                pass
-    elif int(old_score["opponent"]["score"]) < int(opponent["score"]):
-        disc_embed.title_key = "goal_away_title"
-        disc_embed.description_key = "goal_away"
-        disc_embed.thumbnail = get_team_image(values["opponent"])
-        disc_embed.hex_color = 0xFF0000
-
-    if not disc_embed.title_key:
-        raise DiscException("No goal")
-
-    data = {"team": team, "opponent": opponent}
-    with open("data/score.json", "w", encoding="utf-8") as f:
-        json.dump(data, f)
-
-    return disc_embed
+    # The score is the cursor of the match, anything up to it was announced before (also across restarts)
+    goals = state.update_score(our_team, opponent)
+    state.mark_handled("score", response.digest)
+
+    # Every image and the scorer are fetched once, however many goals there were
+    team_image = opponent_image = None
+    scorer_info = {}
+    if any(side == "team" for side, _, _ in goals):
+        team_image, scorer_info = await asyncio.gather(_image_or_none(get_team_image(team)), _get_scorer_info(team))
+    if any(side == "opponent" for side, _, _ in goals):
+        opponent_image = await _image_or_none(get_team_image(team, opponent["team"]))
+
+    embeds = []
+    for number, (side, team_score, opponent_score) in enumerate(goals, start=state.goal_count - len(goals) + 1):
+        values = {
+            "home_team": r["homeTeam"],
+            "away_team": r["awayTeam"],
+            "team": team.displayed_name,
+            "opponent": opponent["team"],
+            "team_score": team_score,
+            "opponent_score": opponent_score,
+        }
+        # Numbered by the goal count rather than the score, so a goal after an overturned one gets a new id, while the
+        # same goal seen again (e.g. after a restart) gets the same id
+        goal_id = f"{team.key}:{state.start}:goal:{number}"
+        if side == "team":
+            disc_embed = DiscEmbed(
+                title_key="goal_home_title",
+                description_key="goal_home",
+                values=values,
+                hex_color=0x00FF00,
+                thumbnail=team_image,
+                event_id=goal_id,
+            )
+        else:
+            disc_embed = DiscEmbed(
+                title_key="goal_away_title",
+                description_key="goal_away",
+                values=values,
+                hex_color=0xFF0000,
+                thumbnail=opponent_image,
+                event_id=goal_id,
+            )
+        embeds.append(disc_embed)
+
+    # The most recent scorer can only be credited for the last goal of the team
+    team_goals = [disc_embed for (side, _, _), disc_embed in zip(goals, embeds) if side == "team"]
+    if team_goals and scorer_info:
+        state.add_scorer(scorer_info["player_id"])
+        team_goals[-1].appended_description = scorer_info["appended_description"]
+        # Overwrite the thumbnail with the player image if there is one
+        try:
+            team_goals[-1].thumbnail = await get_player_image(team, scorer_info["player_id"], image_type="goal")
+        except DiscException:
+            pass
+
+    return embeds
@@ -0,0 +1,103 @@
+import asyncio
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable
+
+import cachetools
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    ttl: float  # Seconds a value is fresh
+    stale: float = 0  # Seconds after that a value is still served while it is refreshed in the background
+    negative_ttl: float = 1  # Seconds a failure is remembered before trying again
+
+
+@dataclass
+class _Entry:
+    value: Any
+    fresh_until: float
+    stale_until: float
+    failed: bool = False
+
+
+class ResponseCache:
+    """Cache for async loaders with per-key policies.
+
+    Concurrent misses for the same key share one in-flight load, expired values are served while they are being
+    refreshed (within the stale window of the policy) and failures are cached (and raised again) for a short time.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024) -> None:
+        # Limited by the memory of the values (see __sizeof__ of the values), not their number
+        self._entries = cachetools.LRUCache(maxsize=max_bytes, getsizeof=lambda entry: sys.getsizeof(entry.value))
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.stats = Counter()
+
+    @property
+    def nbytes(self) -> int:
+        return self._entries.currsize
+
+    @property
+    def hit_ratio(self) -> float:
+        hits = self.stats["hit"] + self.stats["stale"] + self.stats["coalesced"]
+        total = hits + self.stats["miss"] + self.stats["negative"]
+        return hits / total if total else 0.0
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether get would return a (fresh or stale) value right away, without waiting for a load"""
+        entry = self._entries.get(key)
+        return entry is not None and not entry.failed and time.monotonic() < entry.stale_until
+
+    def put(self, key: Hashable, value: Any, policy: CachePolicy) -> None:
+        now = time.monotonic()
+        try:
+            self._entries[key] = _Entry(value, now + policy.ttl, now + policy.ttl + policy.stale)
+        except ValueError:
+            # Larger than the whole cache, so it's loaded every time (and an older value mustn't be served instead)
+            self._entries.pop(key, None)
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[Any]], policy: CachePolicy) -> Any:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and now < entry.fresh_until:
+            if entry.failed:
+                self.stats["negative"] += 1
+                raise entry.value
+            self.stats["hit"] += 1
+            return entry.value
+
+        if entry and not entry.failed and now < entry.stale_until:
+            self.stats["stale"] += 1
+            self._start(key, load, policy)
+            return entry.value
+
+        self.stats["coalesced" if key in self._inflight else "miss"] += 1
+        # Shielded, so a cancelled caller doesn't cancel the load for everyone else waiting on it
+        return await asyncio.shield(self._start(key, load, policy))
+
+    def _start(self, key: Hashable, load: Callable[[], Awaitable[Any]], policy: CachePolicy) -> asyncio.Task:
+        if key not in self._inflight:
+            task = asyncio.create_task(self._load(key, load, policy))
+            # Failures are handled in _load, this only keeps asyncio from warning about unawaited refreshes
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return self._inflight[key]
+
+    async def _load(self, key: Hashable, load: Callable[[], Awaitable[Any]], policy: CachePolicy) -> Any:
+        try:
+            value = await load()
+        except Exception as e:
+            now = time.monotonic()
+            entry = self._entries.get(key)
+            # A failed refresh keeps serving the stale value until the stale window runs out
+            if not entry or entry.failed or now >= entry.stale_until:
+                self._entries[key] = _Entry(e, now + policy.negative_ttl, now + policy.negative_ttl, failed=True)
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        self.put(key, value, policy)
+        return value
@@ -0,0 +1,114 @@
+import json
+import os
+from string import Formatter
+from typing import Optional
+
+LOCALES_DIRECTORY = os.path.join(os.path.dirname(__file__), "locales")
+# Every message and command must exist in the default locale, it's the end of every fallback chain
+DEFAULT_LOCALE = "en"
+
+
+class Template:
+    """A message parsed once, so rendering it only fills in the values"""
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self._parts = []
+        for literal, field, format_spec, conversion in Formatter().parse(text):
+            if format_spec or conversion:
+                raise ValueError(f"Format specs and conversions aren't supported: {text}")
+            self._parts.append((literal, field))
+        self.fields = {field for _, field in self._parts if field}
+
+    def render(self, values: dict) -> str:
+        try:
+            return "".join(literal + (str(values[field]) if field else "") for literal, field in self._parts)
+        # If the values are missing, return the original message
+        except (KeyError, TypeError):
+            return self.text
+
+
+class MessageCatalog:
+    """Messages and command names of every locale in the locales directory, with their fallbacks resolved at load.
+
+    A locale file (e.g. locales/nb.json) has "messages" and "commands", and can name the locale it falls back to for
+    anything it doesn't translate with "fallback" (e.g. "no"). Without it a locale falls back to its language (e.g.
+    en-GB to en) and finally to the default locale.
+    """
+
+    def __init__(self, messages: dict[str, dict[str, Template]], commands: dict[str, dict[str, str]]) -> None:
+        self.messages = messages
+        self.commands = commands
+
+    @property
+    def locales(self) -> tuple[str, ...]:
+        return tuple(self.messages)
+
+    @classmethod
+    def load(cls, directory: str = LOCALES_DIRECTORY) -> "MessageCatalog":
+        files = {}
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".json"):
+                with open(os.path.join(directory, filename), encoding="utf-8") as f:
+                    files[filename.removesuffix(".json")] = json.load(f)
+        if DEFAULT_LOCALE not in files:
+            raise ValueError(f"Missing the default locale {DEFAULT_LOCALE}.json in {directory}")
+
+        messages, commands = {}, {}
+        default = {key: Template(text) for key, text in files[DEFAULT_LOCALE]["messages"].items()}
+        for locale, data in files.items():
+            # Validated before merging, so a mistake is reported for the file it is in
+            for key, text in data.get("messages", {}).items():
+                if key not in default:
+                    raise ValueError(f"{locale}: unknown message {key}")
+                unknown = Template(text).fields - default[key].fields
+                if unknown:
+                    raise ValueError(f"{locale}: unknown placeholders {unknown} in {key}")
+            for key in data.get("commands", {}):
+                if key not in files[DEFAULT_LOCALE]["commands"]:
+                    raise ValueError(f"{locale}: unknown command string {key}")
+
+            # The most specific locale is applied last, so it overrides the ones it falls back to
+            chain = cls._chain(locale, files)
+            messages[locale] = {
+                key: Template(text)
+                for fallback in reversed(chain)
+                for key, text in files[fallback].get("messages", {}).items()
+            }
+            commands[locale] = {
+                key: text for fallback in reversed(chain) for key, text in files[fallback].get("commands", {}).items()
+            }
+        return cls(messages, commands)
+
+    @staticmethod
+    def _chain(locale: str, files: dict[str, dict]) -> list[str]:
+        """The locale followed by the locales it falls back to, e.g. ["nb", "no", "en"]"""
+        chain = [locale]
+        while chain[-1] != DEFAULT_LOCALE:
+            current = chain[-1]
+            fallback = files[current].get("fallback") or current.split("-")[0]
+            if fallback == current or fallback not in files:
+                fallback = DEFAULT_LOCALE
+            if fallback in chain:
+                raise ValueError(f"{locale}: circular fallback {' -> '.join([*chain, fallback])}")
+            chain.append(fallback)
+        return chain
+
+    def _resolve(self, locale: str) -> str:
+        if locale in self.messages:
+            return locale
+        language = locale.split("-")[0]
+        return language if language in self.messages else DEFAULT_LOCALE
+
+    def template(self, locale: str, key: str) -> Template:
+        return self.messages[self._resolve(locale)][key]
+
+    def render(self, locale: str, key: str, values: Optional[dict] = None) -> str:
+        return self.template(locale, key).render(values or {})
+
+    def command(self, locale: str, key: str) -> Optional[str]:
+        """The translation of a command string, or None if it isn't one"""
+        return self.commands[self._resolve(locale)].get(key)
+
+
+CATALOG = MessageCatalog.load()
@@ -1,33 +1,57 @@
+import asyncio
+import hashlib
+import json
+import os
 import sys
 from inspect import getmembers
+from typing import Optional
 
 import discord
 
 import api_handler
+import memory
 import subscribers
-from __init__ import LANGUAGE, DISPLAYED_TEAM_NAME
-from manifest import FORMAT_MESSAGES, SUPPORTED_LANGUAGES
-from models import DiscEmbed, DiscException
+from __init__ import LANGUAGE
+from catalog import CATALOG
+from manifest import SUPPORTED_LANGUAGES
+from models import DiscEmbed
+from teams import DEFAULT_TEAM, TEAMS, Team
 from translator import DiscTranslator
 
+# The fingerprint of the last command tree synced with Discord
+COMMAND_TREE_FILE = "data/command_tree.json"
+
+TEAM_CHOICES = [discord.app_commands.Choice(name=team.displayed_name, value=team.key) for team in TEAMS.values()]
+
+
+def _get_team(channel_id: int, key: Optional[str]) -> Team:
+    """The chosen team, otherwise the first team the channel is subscribed to"""
+    if key in TEAMS:
+        return TEAMS[key]
+    subscribed = [key for key in subscribers.get_teams(channel_id) if key in TEAMS]
+    return TEAMS[subscribed[0]] if subscribed else DEFAULT_TEAM
+
 
 @discord.app_commands.command(name="subscribe", description="subscribe_description")
-async def subscribe(ctx, opt_language: SUPPORTED_LANGUAGES = LANGUAGE) -> None:
+@discord.app_commands.choices(opt_team=TEAM_CHOICES)
+async def subscribe(ctx, opt_language: SUPPORTED_LANGUAGES = LANGUAGE, opt_team: str = None) -> None:
     """Subscribe the current channel to live updates"""
-    _lang = subscribers.get_lang(ctx.channel.id)  # TODO: Don't read the file twice
-    subscribing = subscribers.toggle(ctx.channel.id, lang=opt_language)
+    team = _get_team(ctx.channel.id, opt_team)
+    _lang = subscribers.get_lang(ctx.channel.id)
+    # Direct messages are stored with guild id 0, they are delivered by the first shard like Discord does
+    subscribing = subscribers.toggle(ctx.channel.id, team.key, lang=opt_language, guild_id=ctx.guild_id or 0)
     if subscribing:
-        response = FORMAT_MESSAGES[opt_language]["subscribe"].format(team=DISPLAYED_TEAM_NAME)
+        response = CATALOG.render(opt_language, "subscribe", {"team": team.displayed_name})
         await ctx.response.send_message(response)
     else:
-        response = FORMAT_MESSAGES[_lang]["unsubscribe"]
+        response = CATALOG.render(_lang, "unsubscribe")
         await ctx.response.send_message(response)
 
 
 @discord.app_commands.command(name="channels", description="channels_description")
 async def channels(ctx) -> None:
     """List all active channels"""
-    active_channels = [ch for ch in subscribers.get_channels().keys() if ctx.guild.get_channel(int(ch))]
+    active_channels = [ch for ch in subscribers.get_subscribed_channels() if ctx.guild.get_channel(int(ch))]
     disc_embed = DiscEmbed(
         title_key="active_channels_title",
         description_key="no_active_channels",
@@ -44,22 +68,66 @@ async def channels(ctx) -> None:
 async def language(ctx, opt_language: SUPPORTED_LANGUAGES = LANGUAGE) -> None:
     """Change the language of the current channel"""
     subscribers.set_lang(ctx.channel.id, opt_language)
-    await ctx.response.send_message(FORMAT_MESSAGES[opt_language]["language_set"], ephemeral=True)
+    await ctx.response.send_message(CATALOG.render(opt_language, "language_set"), ephemeral=True)
+
+
+@discord.app_commands.command(name="live_card", description="live_card_description")
+async def live_card(ctx, opt_enabled: bool = True) -> None:
+    """Switch the current channel between a single live card per match and a message per event"""
+    subscribers.set_live_card(ctx.channel.id, opt_enabled)
+    key = "live_card_enabled" if opt_enabled else "live_card_disabled"
+    await ctx.response.send_message(CATALOG.render(subscribers.get_lang(ctx.channel.id), key), ephemeral=True)
 
 
 @discord.app_commands.command(name="next_match", description="next_match_description")
-async def next_match(ctx) -> None:
+@discord.app_commands.choices(opt_team=TEAM_CHOICES)
+async def next_match(ctx, opt_team: str = None) -> None:
     """Get information about the next match"""
+    team = _get_team(ctx.channel.id, opt_team)
     lang = subscribers.get_lang(ctx.channel.id)
+    # The card is normally answered from memory, only loading it the first time can take longer than Discord allows
+    if not api_handler.has_next_match_card(team):
+        await ctx.response.defer()
+        send = ctx.followup.send
+    else:
+        send = ctx.response.send_message
+
+    # Once deferred, the reply is public like the deferred response, only an immediate one can be hidden
     try:
-        match_string = api_handler.get_next_match()
-        match_string.thumbnail = api_handler.get_team_image()
-        embed = match_string.embed(lang=lang)
-        await ctx.response.send_message(embed=embed, files=match_string.files)
-    except DiscException:
-        if "no_next_match" not in FORMAT_MESSAGES[lang]:
-            lang = "en"
-        await ctx.response.send_message(FORMAT_MESSAGES[lang]["no_next_match"], ephemeral=True)
+        card = await api_handler.get_next_match_card(team)
+    except Exception as e:
+        # Always answer, otherwise a deferred interaction keeps showing that the bot is thinking
+        print(f"Failed to get the next match of {team.key}: {e!r}")
+        await send(CATALOG.render(lang, "next_match_failed"), ephemeral=not ctx.response.is_done())
+        return
+    if card is None:
+        await send(CATALOG.render(lang, "no_next_match"), ephemeral=not ctx.response.is_done())
+        return
+    # Rendered for every reply, so nothing in it is as old as the cached card
+    await send(embed=card.embed(lang), files=card.files)
+
+
+async def _is_owner(ctx) -> bool:
+    """Whether the user owns the bot, or is a member of the team owning it"""
+    app = await ctx.client.application_info()
+    if app.team:
+        return any(member.id == ctx.user.id for member in app.team.members)
+    return app.owner.id == ctx.user.id
+
+
+@discord.app_commands.command(name="memory", description="memory_description")
+@discord.app_commands.default_permissions()
+async def memory_report(ctx) -> None:
+    """Show the memory report, only to the owners of the bot"""
+    if not await _is_owner(ctx):
+        response = CATALOG.render(subscribers.get_lang(ctx.channel.id), "owner_only")
+        await ctx.response.send_message(response, ephemeral=True)
+        return
+    # Taking a snapshot of a large heap can take longer than Discord allows for a response, and would block the loop
+    await ctx.response.defer(ephemeral=True)
+    report = await asyncio.to_thread(memory.report)
+    # Messages are limited to 2000 characters
+    await ctx.followup.send(f"```\n{report[:1950]}\n```", ephemeral=True)
 
 
 async def add_commands(tree: discord.app_commands.CommandTree) -> None:
@@ -67,3 +135,28 @@ async def add_commands(tree: discord.app_commands.CommandTree) -> None:
     commands = getmembers(sys.modules[__name__], lambda x: isinstance(x, discord.app_commands.Command))
     [tree.add_command(command[1]) for command in commands]
     await tree.set_translator(DiscTranslator())
+
+
+async def sync_commands(tree: discord.app_commands.CommandTree) -> bool:
+    """Sync the command tree with Discord, but only if it (or its translations) changed since the last sync"""
+    commands = tree.get_commands()
+    if tree.translator:
+        payload = [await command.get_translated_payload(tree, tree.translator) for command in commands]
+    else:
+        payload = [command.to_dict(tree) for command in commands]
+    # The same payload Discord would get, so any change to names, options or translations causes a sync
+    data = json.dumps({"application_id": tree.client.application_id, "commands": payload}, sort_keys=True, default=str)
+    fingerprint = hashlib.sha256(data.encode()).hexdigest()
+
+    if os.path.exists(COMMAND_TREE_FILE):
+        with open(COMMAND_TREE_FILE, encoding="utf-8") as f:
+            if json.load(f).get("fingerprint") == fingerprint:
+                return False
+
+    await tree.sync()
+    os.makedirs(os.path.dirname(COMMAND_TREE_FILE), exist_ok=True)
+    with open(f"{COMMAND_TREE_FILE}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint}, f)
+    os.replace(f"{COMMAND_TREE_FILE}.tmp", COMMAND_TREE_FILE)
+    print(f"Synced {len(commands)} commands")
+    return True
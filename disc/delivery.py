@@ -0,0 +1,58 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+# Discord allows 50 requests per second per bot across all routes
+GLOBAL_RATE_LIMIT = 50
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions every `per` seconds"""
+
+    def __init__(self, rate: float, per: float = 1.0) -> None:
+        self.rate = rate
+        self.per = per
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate / self.per)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.per / self.rate)
+
+
+class DeliveryScheduler:
+    """Send to many channels concurrently, bounded by a concurrency limit and the global rate limit.
+
+    Per-route buckets and 429 retries are handled by discord.py's HTTP client, since every send goes through it.
+    """
+
+    def __init__(self, concurrency: int, rate: float = GLOBAL_RATE_LIMIT) -> None:
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._limiter = RateLimiter(rate)
+
+    async def _send(self, send: Callable[[int], Awaitable[Any]], channel_id: int) -> None:
+        async with self._semaphore:
+            await self._limiter.acquire()
+            await send(channel_id)
+
+    async def deliver(self, channels: Iterable[str], send: Callable[[int], Awaitable[Any]]) -> dict[int, Exception]:
+        """Call `send` for every channel and return the failures by channel id"""
+        channel_ids = [int(channel) for channel in channels]
+        results = await asyncio.gather(
+            *(self._send(send, channel_id) for channel_id in channel_ids), return_exceptions=True
+        )
+        failures = {
+            channel_id: result for channel_id, result in zip(channel_ids, results) if isinstance(result, Exception)
+        }
+        for channel_id, error in failures.items():
+            print(f"Failed to send to channel {channel_id}: {error!r}")
+        return failures
@@ -0,0 +1,71 @@
+import os
+import pickle
+import sqlite3
+import time
+from typing import Any, Iterator, Optional
+
+DATABASE = "data/events.db"
+# Events are only kept long enough for workers to catch up after a restart
+RETENTION = 24 * 60 * 60
+# Older events aren't delivered when a worker catches up, a goal from ten minutes ago is no longer news
+MAX_AGE = 5 * 60
+
+
+class EventLog:
+    """Append-only log of detected events in SQLite, shared by the poller and the worker processes.
+
+    The poller appends every embed and presence change, each worker reads everything after its own cursor and
+    delivers it to the channels of its shards.
+    """
+
+    def __init__(self, database: str = DATABASE) -> None:
+        if not os.path.exists(os.path.dirname(database)):
+            os.mkdir(os.path.dirname(database))
+        # Autocommit mode and WAL, so readers in other processes never block the poller
+        self._db = sqlite3.connect(database, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS events "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, team TEXT, payload BLOB NOT NULL, "
+            "created REAL NOT NULL)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS cursors (worker TEXT PRIMARY KEY, event_id INTEGER NOT NULL)")
+
+    def append(self, kind: str, team: Optional[str], payload: Any) -> int:
+        now = time.time()
+        self._db.execute("DELETE FROM events WHERE created < ?", (now - RETENTION,))
+        cursor = self._db.execute(
+            "INSERT INTO events (kind, team, payload, created) VALUES (?, ?, ?, ?)",
+            (kind, team, pickle.dumps(payload), now),
+        )
+        return cursor.lastrowid
+
+    def read(self, after: int) -> Iterator[tuple[int, str, Optional[str], Any]]:
+        """All events after the given id that aren't too old to deliver, oldest first"""
+        rows = self._db.execute(
+            "SELECT id, kind, team, payload FROM events WHERE id > ? AND created >= ? ORDER BY id",
+            (after, time.time() - MAX_AGE),
+        ).fetchall()
+        for event_id, kind, team, payload in rows:
+            yield event_id, kind, team, pickle.loads(payload)
+
+    def latest(self, kind: str) -> Any:
+        row = self._db.execute("SELECT payload FROM events WHERE kind = ? ORDER BY id DESC LIMIT 1", (kind,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def get_cursor(self, worker: str) -> int:
+        """The last event the worker handled, new workers start at the end of the log"""
+        row = self._db.execute("SELECT event_id FROM cursors WHERE worker = ?", (worker,)).fetchone()
+        if row:
+            return row[0]
+        return self._db.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def set_cursor(self, worker: str, event_id: int) -> None:
+        self._db.execute(
+            "INSERT INTO cursors (worker, event_id) VALUES (?, ?) ON CONFLICT (worker) DO UPDATE SET event_id = ?",
+            (worker, event_id, event_id),
+        )
+
+    def close(self) -> None:
+        self._db.close()
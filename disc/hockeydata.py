@@ -0,0 +1,142 @@
+import hashlib
+import json
+import sys
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Any, Optional
+
+import aiohttp
+import cachetools
+
+from recorder import Recorder
+
+# Decoded json takes about four times the size of its text as Python objects
+JSON_OVERHEAD = 4
+
+
+@dataclass
+class HockeyDataResponse:
+    status: int
+    body: bytes
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    _json: Any = field(default=None, init=False, repr=False)
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    @cached_property
+    def digest(self) -> str:
+        return hashlib.blake2b(self.body, digest_size=16).hexdigest()
+
+    def json(self) -> Any:
+        """The decoded body, only decoded once per response"""
+        if self._json is None:
+            self._json = json.loads(self.body)
+        return self._json
+
+    def __sizeof__(self) -> int:
+        # Counted as decoded by the caches limited in bytes, since a response is decoded right after it's cached
+        return object.__sizeof__(self) + len(self.body) * (1 + JSON_OVERHEAD)
+
+
+class HockeyDataClient:
+    """Async HockeyData client sharing one pooled keep-alive session"""
+
+    def __init__(
+        self,
+        timeout: float = 10,
+        connect_timeout: float = 5,
+        limit: int = 10,
+        recorder: Optional[Recorder] = None,
+        max_bytes: int = 8 * 1024 * 1024,
+    ) -> None:
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.limit = limit
+        self._session: Optional[aiohttp.ClientSession] = None
+        # The last response of every polled endpoint, a response that was evicted is simply fetched unconditionally
+        self._responses = cachetools.LRUCache(maxsize=max_bytes, getsizeof=sys.getsizeof)
+        # Writes every response to a recording that can be replayed, if set
+        self.recorder = recorder
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # The session has to be created inside the running event loop, so it is created on first use
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                raise_for_status=True,
+            )
+        return self._session
+
+    async def fetch(
+        self, endpoint: str, api_key: str, etag: Optional[str] = None, last_modified: Optional[str] = None
+    ) -> HockeyDataResponse:
+        """Conditional GET, returning a 304 response if the validators still match"""
+        headers = {"HockeyData-API-Key": api_key or ""}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        try:
+            async with self.session.get(endpoint, headers=headers) as r:
+                response = HockeyDataResponse(
+                    status=r.status,
+                    body=await r.read(),
+                    etag=r.headers.get("ETag"),
+                    last_modified=r.headers.get("Last-Modified"),
+                )
+        except Exception as e:
+            if self.recorder:
+                self.recorder.record_error(endpoint, e)
+            raise
+        if self.recorder:
+            self.recorder.record(endpoint, response.status, response.body, response.digest)
+        return response
+
+    async def poll(self, endpoint: str, api_key: str) -> HockeyDataResponse:
+        """Fetch an endpoint, returning the previous response object if the content hasn't changed.
+
+        Conditional requests are used if the server sends validators, otherwise the body is compared with the previous
+        one. Either way an unchanged payload is never decoded twice.
+        """
+        previous = self._responses.get(endpoint)
+        if previous:
+            r = await self.fetch(endpoint, api_key, etag=previous.etag, last_modified=previous.last_modified)
+            if r.not_modified or r.body == previous.body:
+                return previous
+        else:
+            r = await self.fetch(endpoint, api_key)
+        self._remember(endpoint, r)
+        return r
+
+    def _remember(self, endpoint: str, r: HockeyDataResponse) -> None:
+        try:
+            self._responses[endpoint] = r
+        except ValueError:
+            # Larger than the whole cache
+            self._responses.pop(endpoint, None)
+
+    @property
+    def nbytes(self) -> int:
+        return self._responses.currsize
+
+    def prime(self, endpoint: str, body: bytes) -> HockeyDataResponse:
+        """Use a payload received elsewhere (e.g. the live stream) as the newest response of an endpoint"""
+        previous = self._responses.get(endpoint)
+        if previous and previous.body == body:
+            return previous
+        r = HockeyDataResponse(status=200, body=body)
+        self._remember(endpoint, r)
+        if self.recorder:
+            self.recorder.record(endpoint, r.status, r.body, r.digest)
+        return r
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        if self.recorder:
+            self.recorder.close()
@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+import cachetools
+
+
+@dataclass
+class CachedImage:
+    data: bytes = field(repr=False)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    validated_at: float = 0
+
+    def is_fresh(self, max_age: float) -> bool:
+        return time.time() - self.validated_at < max_age
+
+
+class ImageCache:
+    """Processed images kept in a size-limited in-memory LRU in front of a directory on disk"""
+
+    def __init__(self, directory: str = "data/images", max_bytes: int = 32 * 1024 * 1024) -> None:
+        self.directory = directory
+        self._memory = cachetools.LRUCache(maxsize=max_bytes, getsizeof=lambda image: len(image.data))
+
+    @property
+    def nbytes(self) -> int:
+        return self._memory.currsize
+
+    def _path(self, key: tuple) -> str:
+        # Team names can contain any character, so the file name is a hash of the key
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    async def get(self, key: tuple) -> Optional[CachedImage]:
+        if key in self._memory:
+            return self._memory[key]
+        # Disk access is done in a thread, so a slow disk never blocks the event loop
+        image = await asyncio.to_thread(self._read, key)
+        if image:
+            self._remember(key, image)
+        return image
+
+    async def put(self, key: tuple, image: CachedImage) -> None:
+        self._remember(key, image)
+        await asyncio.to_thread(self._write, key, image)
+
+    def _remember(self, key: tuple, image: CachedImage) -> None:
+        try:
+            self._memory[key] = image
+        except ValueError:
+            pass  # Larger than the whole memory cache, so it's only stored on disk
+
+    def _read(self, key: tuple) -> Optional[CachedImage]:
+        path = self._path(key)
+        try:
+            with open(f"{path}.json", encoding="utf-8") as f:
+                metadata = json.load(f)
+            with open(f"{path}.webp", "rb") as f:
+                return CachedImage(data=f.read(), **metadata)
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _write(self, key: tuple, image: CachedImage) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        metadata = asdict(image)
+        metadata.pop("data")
+        # Write to temporary files and rename them, so a crash never leaves a half written image behind. They're named
+        # after the thread, the same image may be written by two threads at once.
+        tmp = f"{threading.get_ident()}.tmp"
+        with open(f"{path}.webp.{tmp}", "wb") as f:
+            f.write(image.data)
+        with open(f"{path}.json.{tmp}", "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+        os.replace(f"{path}.webp.{tmp}", f"{path}.webp")
+        os.replace(f"{path}.json.{tmp}", f"{path}.json")
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import time
+from typing import Awaitable, Callable, Optional
+
+DATABASE = "data/lease.db"
+# Seconds between the warm ups of a standby
+WARM_INTERVAL = 5
+
+
+class Lease:
+    """Leadership among replicas sharing the data directory, held by renewing a row in SQLite before it expires.
+
+    Only the holder polls and delivers, the others wait as standbys and take over once it's released or expires. The
+    database must be on a local volume, SQLite locking isn't reliable over network file systems.
+    """
+
+    def __init__(self, name: str, duration: float, database: str = DATABASE, holder: Optional[str] = None) -> None:
+        self.name = name
+        self.duration = duration
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        # Until when the lease is ours, as far as we know
+        self.expires = 0.0
+        # Set once the lease is first taken
+        self.elected = asyncio.Event()
+        if not os.path.exists(os.path.dirname(database)):
+            os.mkdir(os.path.dirname(database))
+        # A short busy timeout, so a replica holding the write lock never blocks the event loop for long
+        self._db = sqlite3.connect(database, isolation_level=None, timeout=duration / 4)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+
+    @property
+    def held(self) -> bool:
+        return self.expires > time.time()
+
+    def acquire(self) -> bool:
+        """Take the lease if it's free or expired, or renew it if it's ours. Returns whether it's ours."""
+        now = time.time()
+        try:
+            with self._db:
+                # Take the write lock right away, so two replicas never both see the lease as free
+                self._db.execute("BEGIN IMMEDIATE")
+                row = self._db.execute("SELECT holder, expires FROM leases WHERE name = ?", (self.name,)).fetchone()
+                if row and row[0] != self.holder and row[1] > now:
+                    return False
+                self._db.execute(
+                    "INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires",
+                    (self.name, self.holder, now + self.duration),
+                )
+        except sqlite3.OperationalError as e:
+            # Busy, the lease is still ours until it expires
+            print(f"Failed to renew lease {self.name}: {e!r}")
+            return self.held
+        self.expires = now + self.duration
+        return True
+
+    async def hold(self) -> None:
+        """Wait for the lease and keep renewing it, returns once it was lost to another replica"""
+        while True:
+            was_held = self.held
+            if self.acquire():
+                self.elected.set()
+            elif was_held or self.elected.is_set():
+                self.expires = 0.0
+                return
+            await asyncio.sleep(self.duration / 4)
+
+    def release(self) -> None:
+        """Give up the lease, so a standby takes over right away instead of when it expires"""
+        if self.elected.is_set():
+            self._db.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+            self.expires = 0.0
+
+    def close(self) -> None:
+        self._db.close()
+
+
+async def stand_by(lease: Lease, warm: Callable[[], Awaitable[None]]) -> asyncio.Task:
+    """Wait until the lease is taken, warming up every WARM_INTERVAL seconds in the meantime. Returns the task renewing
+    the lease, which ends once it's lost."""
+    hold = asyncio.create_task(lease.hold())
+    warming = asyncio.create_task(_keep_warm(warm))
+    try:
+        await lease.elected.wait()
+    except asyncio.CancelledError:
+        hold.cancel()
+        raise
+    finally:
+        warming.cancel()
+    return hold
+
+
+async def _keep_warm(warm: Callable[[], Awaitable[None]]) -> None:
+    while True:
+        try:
+            await warm()
+        except Exception as e:
+            print(f"Failed to warm up: {e!r}")
+        await asyncio.sleep(WARM_INTERVAL)
@@ -0,0 +1,50 @@
+import os
+import sqlite3
+from typing import Optional
+
+DATABASE = "data/live_cards.db"
+
+
+class LiveCards:
+    """The scoreboard message posted in each channel using live cards, edited in place for the rest of the match"""
+
+    def __init__(self, database: str = DATABASE) -> None:
+        if not os.path.exists(os.path.dirname(database)):
+            os.mkdir(os.path.dirname(database))
+        self._db = sqlite3.connect(database, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS live_cards "
+            "(channel_id TEXT NOT NULL, team TEXT NOT NULL, card_id TEXT NOT NULL, message_id INTEGER NOT NULL, "
+            "PRIMARY KEY (channel_id, team))"
+        )
+        # Looked up for every channel on every edit, so they're kept in memory like the subscriptions
+        self._messages: dict[tuple[str, str], tuple[str, int]] = {}
+        self.reload()
+
+    def reload(self) -> None:
+        """Read every card from the database again, so a standby replica edits the cards the leader posted"""
+        self._messages = {
+            (channel_id, team): (card_id, message_id)
+            for channel_id, team, card_id, message_id in self._db.execute(
+                "SELECT channel_id, team, card_id, message_id FROM live_cards"
+            )
+        }
+
+    def get(self, channel_id: str, team: str, card_id: str) -> Optional[int]:
+        """The message showing the card in the channel, None if it wasn't posted there yet"""
+        card_id_, message_id = self._messages.get((str(channel_id), team), (None, None))
+        # A card of an earlier match is left as it was, the new match gets a new message
+        return message_id if card_id_ == card_id else None
+
+    def set(self, channel_id: str, team: str, card_id: str, message_id: int) -> None:
+        self._db.execute(
+            "INSERT INTO live_cards (channel_id, team, card_id, message_id) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (channel_id, team) DO UPDATE SET card_id = excluded.card_id, message_id = excluded.message_id",
+            (str(channel_id), team, card_id, message_id),
+        )
+        self._messages[(str(channel_id), team)] = card_id, message_id
+
+    def close(self) -> None:
+        self._db.close()
@@ -1,83 +1,480 @@
+# Imported first, so the startup is timed from as early as possible
+import startup
+
+import asyncio
+import signal
+import time
+from typing import Optional
+
 import discord
 from discord.ext import tasks
 
 import api_handler
 import commands
+import memory
+import metrics
 import subscribers
-from __init__ import DISCORD_TOKEN, DISPLAYED_TEAM_NAME
-from models import DiscEmbed, DiscException, BaseEmbed
+from __init__ import (
+    DISCORD_TOKEN,
+    DELIVERY_CONCURRENCY,
+    EVENT_LOG_INTERVAL,
+    LEADER_ELECTION,
+    LEASE_DURATION,
+    LIVE_CARD_INTERVAL,
+    METRICS_HOST,
+    METRICS_PORT,
+    ROLE,
+    SHARD_COUNT,
+    SHARD_IDS,
+)
+from __init__ import settings as config
+from delivery import DeliveryScheduler, GLOBAL_RATE_LIMIT
+from events import EventLog
+from lease import Lease, stand_by
+from live_cards import LiveCards
+from models import DiscEmbed, BaseEmbed
+from outbox import Outbox, BATCH_SIZE, MAX_ATTEMPTS
+from poller import Poller
+from settings import SettingsError
+from teams import TEAMS, Team
+
+startup.mark("imports")
+
+
+class HockeyDisc(discord.AutoShardedClient):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # The global rate limit is shared by all processes, so each gets the part of its shards
+        rate = GLOBAL_RATE_LIMIT * len(self.shard_ids) / self.shard_count if self.shard_ids else GLOBAL_RATE_LIMIT
+        self.delivery = DeliveryScheduler(DELIVERY_CONCURRENCY, rate=rate)
+        # Polling happens in this process, unless a poller process writes what to send to the event log
+        self.poller = Poller(self.send_embed, self.set_presence, self.update_card) if ROLE == "all" else None
+        # The databases are opened in setup_hook, so creating the client doesn't touch the filesystem
+        self.events: Optional[EventLog] = None
+        self._event_cursor = 0
+        self.presence = None
+        # Embeds are queued in the outbox and sent by its own task, so polling never waits for a fan-out
+        self.outbox: Optional[Outbox] = None
+        self._outbox_task = None
+        self._outbox_wakeup = asyncio.Event()
+        # Events being delivered by id, with when their first channel received them
+        self._outbox_events: dict[str, tuple[str, BaseEmbed, Optional[float]]] = {}
+        self.live_cards: Optional[LiveCards] = None
+        # The newest card of each team not shown yet, updates in between are never sent
+        self._cards: dict[str, BaseEmbed] = {}
+        # With leader election, everything above only starts once this replica holds the lease
+        self.lease: Optional[Lease] = None
+        self._lead_task = None
+        self._started = asyncio.Event()
+
+    @property
+    def worker_name(self) -> str:
+        return f"shards-{','.join(map(str, self.shard_ids))}" if self.shard_ids else "shards-all"
+
+    async def setup_hook(self) -> None:
+        """Runs once after logging in, before connecting to the gateway (unlike on_ready, which runs on every
+        reconnect), so polling and sending over HTTP start right away"""
+        startup.mark("login")
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, print_memory_report)
+        if METRICS_PORT:
+            await metrics.start_server(METRICS_HOST, METRICS_PORT)
+        self.outbox = Outbox(self.worker_name)
+        self.live_cards = LiveCards()
+        if ROLE == "worker":
+            self.events = EventLog()
+        startup.mark("databases")
+        await commands.add_commands(tree)
+
+        if LEADER_ELECTION:
+            self.lease = Lease(self.worker_name, LEASE_DURATION)
+            metrics.LEADER.collect = lambda: {(): float(self.lease.held)}
+            self._lead_task = asyncio.create_task(self._lead())
+        else:
+            metrics.LEADER.collect = lambda: {(): 1.0}
+            await self._start()
+
+    async def _lead(self) -> None:
+        """Wait as a standby until this replica holds the lease, then take over until it's lost"""
+        print(f"Waiting for the lease as {self.lease.holder}")
+        hold = await stand_by(self.lease, self._warm)
+        print(f"Took the lease as {self.lease.holder}")
+        startup.mark("standby")
+        # Continue where the previous leader stopped
+        self.reload_state()
+        await self._start()
+        await hold
+        print("Lost the lease to another replica, stopping")
+        await self.close()
+
+    def reload_state(self) -> None:
+        """Read the subscriptions, match states and live cards the leader wrote"""
+        subscribers.reload()
+        for state in api_handler.states.values():
+            state.load()
+        self.live_cards.reload()
 
+    async def _warm(self) -> None:
+        """Keep a standby ready to take over, with the leader's state and the next match cards prepared"""
+        self.reload_state()
+        for team in TEAMS.values():
+            await api_handler.get_next_match_card(team)
 
-class HockeyDisc(discord.Client):
-    active_match = False
+    async def _start(self) -> None:
+        """Start polling and delivering"""
+        self._started.set()
+        # Deliveries left over from before a restart (or by the previous leader) are resumed right away
+        self._outbox_task = asyncio.create_task(self._drain_outbox())
+        self._flush_cards.start()
+        # Polling starts before syncing the commands, so a slow sync doesn't delay the first poll
+        if self.poller:
+            self.poller.start_streams()
+            self.poller._loop.start()
+        if self.events:
+            self._event_cursor = self.events.get_cursor(self.worker_name)
+            self._read_events.start()
 
-    async def _update(self):
-        await self.get_match_status()
-        if self.active_match:
-            await self.get_score()
+        try:
+            await commands.sync_commands(tree)
+        except discord.HTTPException as e:
+            # The commands synced last time still work, so don't let it stop the bot
+            print(f"Failed to sync commands: {e!r}")
+        startup.mark("commands")
+        # Workers never poll, so they are started once they can deliver
+        if not self.poller:
+            startup.report()
+
+    async def connect(self, *, reconnect: bool = True) -> None:
+        # Standbys stay off the gateway, so commands are only answered by the leader
+        await self._started.wait()
+        await super().connect(reconnect=reconnect)
+
+    @property
+    def leading(self) -> bool:
+        """Whether this replica may send and edit messages, always without leader election"""
+        return self.lease is None or self.lease.held
 
-    async def send_embed(self, disc_embed: BaseEmbed) -> None:
-        """Send an embed to all subscribed channels"""
+    def owns(self, channel_id: str, settings: dict) -> bool:
+        """Whether the channel belongs to a guild on one of the shards of this process"""
+        if self.shard_ids is None:
+            return True
+        guild_id = settings.get("guild_id")
+        if guild_id is None:
+            # Subscribed before guild ids were stored, but then the channel is cached if its guild is on our shards
+            return self.get_channel(int(channel_id)) is not None
+        # Direct messages (guild id 0) go to the first shard
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    async def send_embed(self, team: Team, disc_embed: BaseEmbed) -> None:
+        """Queue an embed for all channels subscribed to the team"""
         # If we use a DiscEmbed (uses title keys), we don't want to send the embed if the title key is missing
         if isinstance(type(disc_embed), DiscEmbed) and not disc_embed.title_key:
             return
 
-        files = list([discord.File(image.fp, image.filename) for image in disc_embed.files if image])
-        for channel, settings in subscribers.get_channels().items():
-            embed = disc_embed.embed(lang=settings.get("lang", "en"))
-            await self.get_channel(int(channel)).send(embed=embed, files=files)
-
-    async def update_status(self, match_status):
-        """Update the presence of the bot"""
-        if match_status.extra_data.get("active_match"):
-            await self.change_presence(
-                activity=discord.CustomActivity(name=f"{api_handler.get_presence_string()}", emoji="🏒")
-            )
-            self.active_match = True
-        else:
-            await self.change_presence(
-                activity=discord.CustomActivity(name=f"Forza {DISPLAYED_TEAM_NAME}! 🥅🏒", emoji="🏒")
-            )
-            self.active_match = False
+        # Channels using live cards see every event on their card instead
+        channels = [
+            channel
+            for channel, settings in subscribers.get_channels(team.key).items()
+            if not settings.get("live_card") and self.owns(channel, settings)
+        ]
+        # An event detected again (e.g. after a restart) was already queued, so it's only sent once
+        if channels and self.outbox.add(disc_embed.event_id, team.key, disc_embed, channels):
+            self._outbox_wakeup.set()
 
-    async def get_match_status(self):
-        """Get the current match status and update the presence"""
-        try:
-            match_status = api_handler.get_match_status()
-        except DiscException:
-            self.active_match = False
+    async def _drain_outbox(self) -> None:
+        """Send the jobs of the outbox as they become due, until the client is closed"""
+        while True:
+            if not self.leading:
+                # The lease couldn't be renewed in time and another replica may be sending, wait until it is
+                await asyncio.sleep(LEASE_DURATION / 4)
+                continue
+            try:
+                for event_id in self.outbox.prune():
+                    print(f"Gave up delivering event {event_id}, it's too old")
+                    self._outbox_events.pop(event_id, None)
+                jobs = self.outbox.due(BATCH_SIZE)
+                if jobs:
+                    await self._send_jobs(jobs)
+                    continue
+            except Exception as e:
+                print(f"Failed to deliver from the outbox: {e!r}")
+                await asyncio.sleep(1)
+                continue
+
+            # Sleep until a job is added or a retry is due
+            next_due = self.outbox.next_due()
+            self._outbox_wakeup.clear()
+            try:
+                timeout = None if next_due is None else max(0.0, next_due - time.time())
+                await asyncio.wait_for(self._outbox_wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _outbox_event(self, event_id: str) -> tuple[str, BaseEmbed, Optional[float]]:
+        # Embeds are unpickled once per event, so their renders are shared by all channels
+        if event_id not in self._outbox_events:
+            team_key, disc_embed, _ = self.outbox.event(event_id)
+            self._outbox_events[event_id] = team_key, disc_embed, None
+        return self._outbox_events[event_id]
+
+    async def _send_jobs(self, jobs: list[tuple[str, str, int]]) -> None:
+        """Send a batch of jobs (at most one per channel), completing each as soon as it's sent, and retry or give up
+        the ones that failed"""
+        job_by_channel = {int(channel_id): (event_id, attempts) for event_id, channel_id, attempts in jobs}
+
+        async def send(channel_id: int) -> None:
+            event_id, _ = job_by_channel[channel_id]
+            if not self.leading:
+                # Lost the lease during the batch, the job stays due for whichever replica holds it now
+                return
+            _, disc_embed, _ = self._outbox_event(event_id)
+            started = time.perf_counter()
+            result = "ok"
+            try:
+                embed = disc_embed.render(lang=subscribers.get_lang(channel_id))
+                await self.get_partial_messageable(channel_id).send(embed=embed, files=disc_embed.files)
+                self.outbox.complete(event_id, channel_id)
+                team_key, _, first = self._outbox_events[event_id]
+                if first is None:
+                    self._outbox_events[event_id] = team_key, disc_embed, time.time()
+            except Exception as e:
+                result = type(e).__name__
+                raise
+            finally:
+                seconds = time.perf_counter() - started
+                metrics.SEND_LATENCY.observe(seconds)
+                metrics.SENDS.inc(result)
+                metrics.trace("send", event_id=event_id, channel=channel_id, seconds=seconds, result=result)
+
+        failures = await self.delivery.deliver(job_by_channel, send)
+        for channel_id, error in failures.items():
+            event_id, attempts = job_by_channel[channel_id]
+            if isinstance(error, discord.NotFound) or (
+                isinstance(error, discord.Forbidden) and attempts + 1 >= MAX_ATTEMPTS
+            ):
+                # The channel was deleted, or we've lost access to it for good
+                print(f"Unsubscribing channel {channel_id}: {error!r}")
+                subscribers.remove_channel(channel_id)
+                self.outbox.remove_channel(channel_id)
+            elif attempts + 1 >= MAX_ATTEMPTS:
+                print(f"Gave up sending event {event_id} to channel {channel_id}")
+                self.outbox.complete(event_id, channel_id)
+            else:
+                self.outbox.retry(event_id, str(channel_id), attempts)
+
+        for event_id in {event_id for event_id, _ in job_by_channel.values()}:
+            if event_id in self._outbox_events and not self.outbox.remaining(event_id):
+                self._finish_event(event_id)
+
+    def _finish_event(self, event_id: str) -> None:
+        """Record how long an event took to reach its first and last channel, once no jobs are left"""
+        team_key, disc_embed, first = self._outbox_events.pop(event_id)
+        if first is None:
+            return
+        first, last = first - disc_embed.detected_at, time.time() - disc_embed.detected_at
+        metrics.EVENT_LATENCY.observe(first, disc_embed.title_key, "first")
+        metrics.EVENT_LATENCY.observe(last, disc_embed.title_key, "last")
+        metrics.trace(
+            "delivered",
+            event_id=event_id,
+            event=disc_embed.title_key,
+            team=team_key,
+            first_seconds=first,
+            last_seconds=last,
+        )
+
+    async def update_card(self, team: Team, card: BaseEmbed) -> None:
+        """Show a new version of the team's live card, in the channels using live cards"""
+        self._cards[team.key] = card
+
+    @tasks.loop(seconds=LIVE_CARD_INTERVAL)
+    async def _flush_cards(self):
+        """Edit every live card at most once per interval, with the newest version of it"""
+        if not self.leading:
+            # Kept for when the lease is renewed, another replica may be editing the cards in the meantime
             return
+        cards, self._cards = self._cards, {}
+        for team_key, card in cards.items():
+            channels = {
+                channel: settings
+                for channel, settings in subscribers.get_channels(team_key).items()
+                if settings.get("live_card") and self.owns(channel, settings)
+            }
+
+            async def send(channel_id: int) -> None:
+                if not self.leading:
+                    return
+                embed = card.render(lang=channels[str(channel_id)].get("lang", "en"))
+                channel = self.get_partial_messageable(channel_id)
+                message_id = self.live_cards.get(channel_id, team_key, card.event_id)
+                if message_id:
+                    try:
+                        # Without new files the message keeps its attachments, so the logo is only uploaded once
+                        await channel.get_partial_message(message_id).edit(embed=embed)
+                        return
+                    except discord.NotFound as e:
+                        # Post a new card if the old one was deleted (code 10008 is an unknown message)
+                        if e.code != 10008:
+                            raise
+                message = await channel.send(embed=embed, files=card.files)
+                self.live_cards.set(channel_id, team_key, card.event_id, message.id)
+
+            await self.delivery.deliver(channels, send)
+
+    async def set_presence(self, presence: str) -> None:
+        self.presence = presence
+        # The presence can only be sent over the gateway, it's set in on_ready if we aren't connected yet
+        if self.is_ready() and self.leading:
+            await self.change_presence(activity=discord.CustomActivity(name=presence, emoji="🏒"))
+
+    def store_guilds(self) -> None:
+        """Store the guilds of channels subscribed before guild ids were stored, once their guild is available"""
+        for team in TEAMS:
+            for channel_id, settings in subscribers.get_channels(team).items():
+                channel = self.get_channel(int(channel_id))
+                if settings.get("guild_id") is None and channel is not None and channel.guild:
+                    subscribers.set_guild(channel_id, channel.guild.id)
+
+    @tasks.loop(seconds=EVENT_LOG_INTERVAL)
+    async def _read_events(self):
+        """Deliver the events the poller process wrote to the event log since the last read"""
+        for event_id, kind, team_key, payload in self.events.read(self._event_cursor):
+            try:
+                if kind == "embed" and team_key in TEAMS:
+                    await self.send_embed(TEAMS[team_key], payload)
+                elif kind == "presence":
+                    await self.set_presence(payload)
+                elif kind == "card" and team_key in TEAMS:
+                    await self.update_card(TEAMS[team_key], payload)
+            except Exception as e:
+                print(f"Failed to handle event {event_id}: {e!r}")
+            self._event_cursor = event_id
+            self.events.set_cursor(self.worker_name, event_id)
+
+    @_read_events.before_loop
+    async def _before_read_events(self):
+        # Channels of the guilds on our shards must be cached before we can tell which ones we own
+        await self.wait_until_ready()
+        presence = self.events.latest("presence")
+        if presence and not self.presence:
+            await self.set_presence(presence)
 
-        await self.update_status(match_status)
+    async def close(self) -> None:
+        if self._lead_task and self._lead_task is not asyncio.current_task():
+            self._lead_task.cancel()
+        if self.poller:
+            await self.poller.close()
+        if self.events:
+            self._read_events.cancel()
+        if self._outbox_task:
+            self._outbox_task.cancel()
+        self._flush_cards.cancel()
+        await super().close()
+        await api_handler.close()
+        await metrics.close()
+        if self.lease:
+            self.lease.release()
+        for database in (self.outbox, self.live_cards, self.events, self.lease):
+            if database:
+                database.close()
 
-        # Send the embed if the embed has a title key (only happens during start/end of match)
-        if match_status.title_key:
-            await self.send_embed(match_status)
 
-    async def get_score(self):
+def print_memory_report() -> None:
+    """Print the memory report on kill -USR1, like /memory. It's made in a thread, a snapshot of a large heap takes
+    long enough to stall polling and sending."""
+    report = asyncio.get_running_loop().run_in_executor(None, memory.report)
+    report.add_done_callback(lambda done: print(done.result(), flush=True))
+
+
+async def run_poller() -> None:
+    """Poll HockeyData and write everything to send to the event log for the worker processes"""
+    events = EventLog()
+
+    async def send_embed(team: Team, disc_embed: BaseEmbed) -> None:
+        events.append("embed", team.key, disc_embed)
+
+    async def set_presence(presence: str) -> None:
+        events.append("presence", None, presence)
+
+    async def update_card(team: Team, card: BaseEmbed) -> None:
+        events.append("card", team.key, card)
+
+    async def warm() -> None:
+        for state in api_handler.states.values():
+            state.load()
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, print_memory_report)
+    if METRICS_PORT:
+        await metrics.start_server(METRICS_HOST, METRICS_PORT)
+    poller = Poller(send_embed, set_presence, update_card)
+    lease = Lease("poller", LEASE_DURATION) if LEADER_ELECTION else None
+    metrics.LEADER.collect = lambda: {(): float(lease.held if lease else True)}
+    try:
+        if lease:
+            print(f"Waiting for the lease as {lease.holder}")
+            hold = await stand_by(lease, warm)
+            print(f"Took the lease as {lease.holder}")
+            startup.mark("standby")
+            await warm()
+        poller.start_streams()
+        poller._loop.start()
+        await (hold if lease else asyncio.Event().wait())
+        print("Lost the lease to another replica, stopping")
+    finally:
+        await poller.close()
+        await api_handler.close()
+        await metrics.close()
+        events.close()
+        if lease:
+            lease.release()
+            lease.close()
+
+
+def main() -> None:
+    try:
+        config.validate()
+    except SettingsError as e:
+        raise SystemExit(str(e))
+    startup.mark("settings")
+    subscribers.initialize()
+    startup.mark("subscribers")
+    for state in api_handler.states.values():
+        state.load()
+    startup.mark("match_state")
+    metrics.STARTUP.collect = lambda: {(phase,): seconds for phase, seconds in startup.phases.items()}
+    # Containers are stopped with SIGTERM, which shuts down like Ctrl+C so a standby takes over right away
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    if ROLE == "poller":
         try:
-            score_string = api_handler.get_goal()
-            await self.send_embed(score_string)
-        except DiscException:
+            asyncio.run(run_poller())
+        except KeyboardInterrupt:
             pass
-
-    @tasks.loop(seconds=5)
-    async def _loop(self):
-        # Every endpoint has a TTL cache, so we can safely call this every 5 seconds (though it might be a bit overkill)
-        await self._update()
+    else:
+        client.run(DISCORD_TOKEN)
 
 
-client = HockeyDisc(intents=discord.Intents.default())
+# The bot only sends to channels and answers commands, so it only needs the guilds and their channels (to tell which
+# channels are on its shards, and for /channels). Members, messages and everything else aren't received or cached.
+intents = discord.Intents.none()
+intents.guilds = True
+client = HockeyDisc(
+    intents=intents,
+    shard_ids=SHARD_IDS,
+    shard_count=SHARD_COUNT,
+    max_messages=None,
+    member_cache_flags=discord.MemberCacheFlags.none(),
+    chunk_guilds_at_startup=False,
+)
 tree = discord.app_commands.CommandTree(client)
 
 
 @client.event
 async def on_ready():
     print(f"Logged in as {client.user.name} ({client.user.id})")
-    client._loop.start()
-    await commands.add_commands(tree)
-    await tree.sync()
+    client.store_guilds()
+    if client.presence:
+        await client.set_presence(client.presence)
 
 
 if __name__ == "__main__":
-    client.run(DISCORD_TOKEN)
+    main()
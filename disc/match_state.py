@@ -0,0 +1,144 @@
+import json
+import os
+import time
+
+from models import MatchStatus
+from teams import DEFAULT_TEAM, Team
+
+STATE_FILE = "data/state.json"
+TEAM_STATE_FILE = "data/state-{key}.json"
+# The number of recent goal scorers remembered, whose images are prepared before a match
+RECENT_SCORERS = 25
+# Written by older versions, only read once to carry the state over
+LEGACY_MATCH_FILE = "data/match.json"
+LEGACY_SCORE_FILE = "data/score.json"
+
+
+class MatchState:
+    """The last known match status and score, persisted in a single snapshot whenever they change"""
+
+    def __init__(self, team: Team) -> None:
+        # The first team keeps the file from before there were multiple teams
+        self.path = STATE_FILE if team == DEFAULT_TEAM else TEAM_STATE_FILE.format(key=team.key)
+        self.team_name = team.displayed_name
+        self.status = MatchStatus.Scheduled.value
+        self.start = None
+        # Identifies the current match across teams, only kept in memory
+        self.match_key = None
+        self.score = self._empty_score()
+        self.scorers: list[int] = []
+        # Goals announced in the current match, only ever increasing (also when a goal is overturned), numbers the goals
+        self.goal_count = 0
+        # Digests of the last handled response per endpoint and when one last changed, only kept in memory
+        self._handled: dict[str, str] = {}
+        self.changed_at = time.time()
+
+    def _empty_score(self) -> dict:
+        return {"team": {"score": 0, "team": self.team_name}, "opponent": {"score": 0, "team": "Unknown"}}
+
+    def _goals_scored(self) -> int:
+        return int(self.score["team"]["score"]) + int(self.score["opponent"]["score"])
+
+    def load(self) -> None:
+        """Read the saved state, called when the bot starts so importing never touches the filesystem"""
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.status = data["status"]
+            self.start = data.get("start")
+            self.score = data["score"]
+            self.scorers = data.get("scorers", [])
+            # Saved before goals were counted, every goal of the score was announced
+            self.goal_count = data.get("goal_count", self._goals_scored())
+            return
+
+        if self.path != STATE_FILE:
+            return
+        if os.path.exists(LEGACY_MATCH_FILE):
+            with open(LEGACY_MATCH_FILE, encoding="utf-8") as f:
+                match = json.load(f)
+            self.status = match["status"]
+            # The whole status response was saved, including the start of the match that the goal ids are made of
+            self.start = match.get("date")
+        if os.path.exists(LEGACY_SCORE_FILE):
+            with open(LEGACY_SCORE_FILE, encoding="utf-8") as f:
+                self.score = json.load(f)
+        self.goal_count = self._goals_scored()
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Write the snapshot to a temporary file and rename it, so a crash never leaves a half written state behind
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "status": self.status,
+                    "start": self.start,
+                    "score": self.score,
+                    "scorers": self.scorers,
+                    "goal_count": self.goal_count,
+                },
+                f,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def has_changed(self, endpoint: str, digest: str) -> bool:
+        return self._handled.get(endpoint) != digest
+
+    def mark_handled(self, endpoint: str, digest: str) -> None:
+        if self._handled.get(endpoint) != digest:
+            self.changed_at = time.time()
+        self._handled[endpoint] = digest
+
+    def update_status(self, status: str, start: str = None) -> tuple[bool, bool]:
+        """Store the new status and return whether the match just started and whether it just ended"""
+        if status == self.status:
+            if start != self.start:
+                self.start = start
+                self.save()
+            return False, False
+
+        just_started = status == MatchStatus.InProgress.value and self.status == MatchStatus.Scheduled.value
+        just_ended = status == MatchStatus.Finished.value and self.status == MatchStatus.InProgress.value
+        self.status = status
+        self.start = start
+        if just_started:
+            # A new match always starts at 0 - 0
+            self.score = self._empty_score()
+            self.goal_count = 0
+        self.save()
+        return just_started, just_ended
+
+    def update_score(self, team: dict, opponent: dict) -> list[tuple[str, int, int]]:
+        """Store the new score and return every goal since the last score, as the scoring side ("team" or
+        "opponent") and the score after that goal.
+
+        The score only tells how many goals each side scored in between, not their order, so the opponent's goals are
+        listed first and the team's last, where the most recent goal scorer is known.
+        """
+        team_score, opponent_score = int(self.score["team"]["score"]), int(self.score["opponent"]["score"])
+        goals = []
+        for opponent_score in range(opponent_score + 1, int(opponent["score"]) + 1):
+            goals.append(("opponent", team_score, opponent_score))
+        opponent_score = int(opponent["score"])
+        for team_score in range(team_score + 1, int(team["score"]) + 1):
+            goals.append(("team", team_score, opponent_score))
+
+        # Only the score and team name are kept, so other fields changing in the response don't cause a write
+        score = {
+            "team": {"score": team["score"], "team": team["team"]},
+            "opponent": {"score": opponent["score"], "team": opponent["team"]},
+        }
+        self.goal_count += len(goals)
+        # The score changes with every goal, so the goal count is saved with it
+        if score != self.score:
+            self.score = score
+            self.save()
+        return goals
+
+    def add_scorer(self, player_id: int) -> None:
+        if player_id in self.scorers:
+            self.scorers.remove(player_id)
+        self.scorers = [player_id, *self.scorers][:RECENT_SCORERS]
+        self.save()
@@ -0,0 +1,63 @@
+import os
+import resource
+import tracemalloc
+from typing import Callable, Optional
+
+# Bytes held by each internal cache, filled in by the modules owning them
+caches: dict[str, Callable[[], int]] = {}
+# The snapshot of the previous report, to show what grew since
+_previous: Optional[tracemalloc.Snapshot] = None
+# Allocations by the tracing itself and the import machinery aren't interesting
+_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def rss_bytes() -> int:
+    """The resident memory of this process right now (or the peak, where it can't be read)"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Without /proc (e.g. macOS, where ru_maxrss is in bytes)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _format(size: int) -> str:
+    return f"{size / 1024 / 1024:.1f} MB" if size >= 1024 * 1024 else f"{size / 1024:.1f} kB"
+
+
+def _location(statistic: tracemalloc.StatisticDiff | tracemalloc.Statistic) -> str:
+    frame = statistic.traceback[0]
+    return f"{os.path.join(*frame.filename.split(os.sep)[-2:])}:{frame.lineno}"
+
+
+def report(limit: int = 10) -> str:
+    """The resident memory, the size of every cache and the lines that allocated the most (and grew the most since
+    the last report). Tracing starts with the first report, unless PYTHONTRACEMALLOC was set."""
+    global _previous
+    lines = [
+        f"Resident memory: {_format(rss_bytes())}",
+        "Caches: " + ", ".join(f"{name} {_format(size())}" for name, size in caches.items()),
+    ]
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        lines.append("Started tracing allocations, report again to see where memory goes")
+        return "\n".join(lines)
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(_FILTERS)
+    current, peak = tracemalloc.get_traced_memory()
+    lines.append(f"Traced: {_format(current)} (peak {_format(peak)})")
+    lines.append("Top allocations:")
+    for statistic in snapshot.statistics("lineno")[:limit]:
+        lines.append(f"  {_format(statistic.size):>9}  {_location(statistic)}")
+    if _previous is not None:
+        lines.append("Since the last report:")
+        for statistic in snapshot.compare_to(_previous, "lineno")[:limit]:
+            sign = "+" if statistic.size_diff >= 0 else "-"
+            lines.append(f"  {sign}{_format(abs(statistic.size_diff)):>8}  {_location(statistic)}")
+    _previous = snapshot
+    return "\n".join(lines)
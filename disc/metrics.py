@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from aiohttp import web
+
+from __init__ import METRICS_TRACE_FILE
+
+# Seconds, from a cached response up to a fan-out to thousands of channels
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry: list["_Metric"] = []
+_runner: Optional[web.AppRunner] = None
+_trace_file = None
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        # Images are converted in a thread pool, so metrics may be updated outside the event loop
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # Per label values: the count of every bucket (not cumulative), the sum and the count
+        self._values: dict[tuple, tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            counts, total, count = self._values.get(labels) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[labels] = counts, total + value, count + 1
+
+    @contextmanager
+    def time(self, *labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> Iterator[str]:
+        for labels, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, f'le="{bound}"')} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, 'le="+Inf"')} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+class Collected(_Metric):
+    """Metric read from elsewhere when it is scraped, `collect` returns the value by label values"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), type: str = "gauge") -> None:
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self.collect: Callable[[], dict[tuple, float]] = dict
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.collect().items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+HOCKEYDATA_LATENCY = Histogram(
+    "hockeydisc_hockeydata_request_seconds", "Duration of HockeyData requests by endpoint", ("endpoint",)
+)
+HOCKEYDATA_ERRORS = Counter(
+    "hockeydisc_hockeydata_errors_total", "Failed HockeyData requests by endpoint", ("endpoint",)
+)
+RESPONSE_CACHE = Collected(
+    "hockeydisc_response_cache_total", "Response cache lookups by result, and failed loads", ("result",), type="counter"
+)
+RESPONSE_CACHE_HIT_RATIO = Collected("hockeydisc_response_cache_hit_ratio", "Share of lookups answered from the cache")
+POLL_LAG = Histogram("hockeydisc_poll_lag_seconds", "How late polls started compared to their scheduled time")
+POLL_DURATION = Histogram("hockeydisc_poll_seconds", "Duration of a poll of all teams, including sending")
+IMAGE_CONVERT = Histogram("hockeydisc_image_convert_seconds", "Time spent resizing and encoding images")
+SEND_LATENCY = Histogram("hockeydisc_send_seconds", "Duration of a single send to a channel")
+SENDS = Counter("hockeydisc_sends_total", "Sends to channels by result (ok or the exception name)", ("result",))
+EVENT_LATENCY = Histogram(
+    "hockeydisc_event_delivery_seconds",
+    "Time from detecting an event until the first (stage=first) and the last (stage=last) channel received it",
+    ("event", "stage"),
+)
+CACHE_BYTES = Collected("hockeydisc_cache_bytes", "Memory held by each internal cache", ("cache",))
+RESIDENT_MEMORY = Collected("hockeydisc_resident_memory_bytes", "Resident memory of the process")
+LEADER = Collected("hockeydisc_leader", "1 if this replica holds the lease (or doesn't use leader election)")
+STARTUP = Collected(
+    "hockeydisc_startup_seconds", "Time spent in each phase of the startup, until the first poll", ("phase",)
+)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+def trace(name: str, **fields) -> None:
+    """Write a record to the trace file (if one is configured)"""
+    global _trace_file
+    if not METRICS_TRACE_FILE:
+        return
+    if _trace_file is None:
+        _trace_file = open(METRICS_TRACE_FILE, "a", encoding="utf-8", buffering=1)
+    _trace_file.write(json.dumps({"time": time.time(), "name": name, **fields}, default=str) + "\n")
+
+
+async def start_server(host: str, port: int) -> None:
+    """Serve the metrics in the Prometheus text format on http://host:port/metrics"""
+    global _runner
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(
+            body=render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+
+
+async def close() -> None:
+    if _runner is not None:
+        await _runner.cleanup()
+    if _trace_file is not None:
+        _trace_file.close()
@@ -1,11 +1,18 @@
-from dataclasses import dataclass
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
 from datetime import datetime, UTC
 from enum import Enum
+from io import BytesIO
 
 import discord
 
 from __init__ import LANGUAGE
-from manifest import FORMAT_MESSAGES
+from catalog import CATALOG
+
+# Approximate bytes of a rendered embed, counted by the caches limited in bytes
+RENDER_SIZE = 1024
 
 
 class MatchStatus(Enum):
@@ -19,6 +26,19 @@ class DiscException(Exception):
     pass
 
 
+@dataclass(frozen=True)
+class Attachment:
+    filename: str
+    data: bytes = field(repr=False)
+
+    def to_file(self) -> discord.File:
+        # BytesIO shares the buffer of a bytes object until it is written to, so this doesn't copy the data
+        return discord.File(BytesIO(self.data), filename=self.filename)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + len(self.data)
+
+
 @dataclass
 class BaseEmbed:
     title: str = None  # Used by DiscEmbedSimple
@@ -28,28 +48,29 @@ class BaseEmbed:
     appended_description: str = ""
 
     hex_color: int = 0x00FF00
-    thumbnail: discord.File = None
+    thumbnail: Attachment = None
     values: dict = dict
     extra_data: dict = dict
 
+    # Used to follow an event through the pipeline in the metrics and traces
+    event_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12], compare=False)
+    detected_at: float = field(default_factory=time.time, compare=False)
+
+    _renders: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __getstate__(self) -> dict:
+        # Rendered embeds aren't needed by other processes reading the event log
+        return {**self.__dict__, "_renders": {}}
+
     def _handle_images(self, embed: discord.Embed) -> discord.Embed:
         if self.thumbnail:
-            self.thumbnail.fp.seek(0)
             embed.set_thumbnail(url=f"attachment://{self.thumbnail.filename}")
         return embed
 
     @property
-    def files(self):
-        return [self.thumbnail] if self.thumbnail else []
-
-    @staticmethod
-    def format_msg(msg: str, values: dict) -> str:
-        """Format a message with the given values"""
-        try:
-            return msg.format(**values)
-        # If the values are missing, return the original message
-        except (KeyError, TypeError):
-            return msg
+    def files(self) -> list[discord.File]:
+        """New file objects for a single send, all sharing the attachment buffers"""
+        return [self.thumbnail.to_file()] if self.thumbnail else []
 
     def create_embed(self, lang=LANGUAGE) -> discord.Embed:
         raise NotImplementedError
@@ -60,16 +81,23 @@ class BaseEmbed:
         embed_object.timestamp = datetime.now(tz=UTC)
         return embed_object
 
+    def render(self, lang=LANGUAGE) -> discord.Embed:
+        """Build the embed once per language and reuse it for every channel using that language"""
+        if lang not in self._renders:
+            self._renders[lang] = self.embed(lang)
+        return self._renders[lang]
+
+    def __sizeof__(self) -> int:
+        # The thumbnail is most of it
+        thumbnail = sys.getsizeof(self.thumbnail) if self.thumbnail else 0
+        return object.__sizeof__(self) + thumbnail + RENDER_SIZE * len(self._renders)
+
 
 @dataclass
 class DiscEmbed(BaseEmbed):
     def create_embed(self, lang=LANGUAGE) -> discord.Embed:
-        # TODO: Use a more sophisticated way to translate the messages than just using a dictionary
-        title_lang = lang if self.title_key in FORMAT_MESSAGES[lang] else "en"
-        description_lang = lang if self.description_key in FORMAT_MESSAGES[lang] else "en"
-
-        title = self.format_msg(FORMAT_MESSAGES[title_lang][self.title_key], self.values)
-        description = self.format_msg(FORMAT_MESSAGES[description_lang][self.description_key], self.values)
+        title = CATALOG.render(lang, self.title_key, self.values)
+        description = CATALOG.render(lang, self.description_key, self.values)
 
         return discord.Embed(
             title=title,
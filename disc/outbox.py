@@ -0,0 +1,131 @@
+import os
+import pickle
+import random
+import sqlite3
+import time
+from typing import Any, Iterable, Optional
+
+DATABASE = "data/outbox.db"
+# Sends are retried with exponential backoff (with jitter) up to this many times
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 2
+BACKOFF_MAX = 300
+# Deliveries of older events are given up, a goal from an hour ago is no longer news
+MAX_AGE = 60 * 60
+# Jobs taken from the outbox at once, the delivery scheduler spreads them out over the rate limit
+BATCH_SIZE = 250
+
+
+class Outbox:
+    """Persistent queue of deliveries, one job per event and channel, surviving restarts.
+
+    Every event is stored once with its embed, and the jobs of a channel are always sent in the order they were
+    added, so a failing send holds back later messages to the same channel but never those of other channels.
+    """
+
+    def __init__(self, worker: str, database: str = DATABASE) -> None:
+        # Several worker processes may share the database, each only takes the jobs it added itself
+        self.worker = worker
+        if not os.path.exists(os.path.dirname(database)):
+            os.mkdir(os.path.dirname(database))
+        self._db = sqlite3.connect(database, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox_events "
+            "(event_id TEXT NOT NULL, worker TEXT NOT NULL, team TEXT NOT NULL, payload BLOB NOT NULL, "
+            "created REAL NOT NULL, PRIMARY KEY (event_id, worker))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox_jobs "
+            "(seq INTEGER PRIMARY KEY AUTOINCREMENT, event_id TEXT NOT NULL, channel_id TEXT NOT NULL, "
+            "worker TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, "
+            "UNIQUE (event_id, channel_id, worker))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS outbox_jobs_channel ON outbox_jobs (worker, channel_id, seq)")
+
+    def add(self, event_id: str, team: str, payload: Any, channels: Iterable[str]) -> bool:
+        """Store an event and a job for each channel, returns False if the event was added before"""
+        now = time.time()
+        with self._db:
+            self._db.execute("BEGIN")
+            # Events are kept until they are too old to send, so an event seen twice is only delivered once
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO outbox_events (event_id, worker, team, payload, created) VALUES (?, ?, ?, ?, ?)",
+                (event_id, self.worker, team, pickle.dumps(payload), now),
+            )
+            if not cursor.rowcount:
+                return False
+            self._db.executemany(
+                "INSERT INTO outbox_jobs (event_id, channel_id, worker, next_attempt) VALUES (?, ?, ?, ?)",
+                [(event_id, str(channel_id), self.worker, now) for channel_id in channels],
+            )
+        return True
+
+    def due(self, limit: int) -> list[tuple[str, str, int]]:
+        """The jobs to send now as (event id, channel id, attempts), at most one per channel"""
+        return self._db.execute(
+            "SELECT event_id, channel_id, attempts FROM outbox_jobs AS job "
+            "WHERE worker = ? AND next_attempt <= ? AND seq = "
+            "(SELECT MIN(seq) FROM outbox_jobs WHERE worker = job.worker AND channel_id = job.channel_id) "
+            "ORDER BY seq LIMIT ?",
+            (self.worker, time.time(), limit),
+        ).fetchall()
+
+    def next_due(self) -> Optional[float]:
+        """When the next job is due (may be in the past), None if there are none"""
+        return self._db.execute(
+            "SELECT MIN(next_attempt) FROM outbox_jobs WHERE worker = ?", (self.worker,)
+        ).fetchone()[0]
+
+    def event(self, event_id: str) -> tuple[str, Any, float]:
+        team, payload, created = self._db.execute(
+            "SELECT team, payload, created FROM outbox_events WHERE event_id = ? AND worker = ?",
+            (event_id, self.worker),
+        ).fetchone()
+        return team, pickle.loads(payload), created
+
+    def complete(self, event_id: str, channel_id: str) -> None:
+        """Remove a job that was sent (or given up), right away so a restart never sends it again"""
+        self._db.execute(
+            "DELETE FROM outbox_jobs WHERE event_id = ? AND channel_id = ? AND worker = ?",
+            (event_id, str(channel_id), self.worker),
+        )
+
+    def retry(self, event_id: str, channel_id: str, attempts: int) -> None:
+        # Full jitter, so channels failing together don't all retry at the same moment
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempts))
+        self._db.execute(
+            "UPDATE outbox_jobs SET attempts = ?, next_attempt = ? "
+            "WHERE event_id = ? AND channel_id = ? AND worker = ?",
+            (attempts + 1, time.time() + delay, event_id, channel_id, self.worker),
+        )
+
+    def remove_channel(self, channel_id: str) -> None:
+        """Drop all jobs of a channel that was unsubscribed"""
+        self._db.execute("DELETE FROM outbox_jobs WHERE channel_id = ? AND worker = ?", (str(channel_id), self.worker))
+
+    def remaining(self, event_id: str) -> int:
+        return self._db.execute(
+            "SELECT COUNT(*) FROM outbox_jobs WHERE event_id = ? AND worker = ?", (event_id, self.worker)
+        ).fetchone()[0]
+
+    def prune(self) -> list[str]:
+        """Give up the jobs of events that are too old and remove the events, returns the ids of the events"""
+        expired = time.time() - MAX_AGE
+        with self._db:
+            self._db.execute("BEGIN")
+            events = [
+                event_id
+                for (event_id,) in self._db.execute(
+                    "SELECT event_id FROM outbox_events WHERE worker = ? AND created < ?", (self.worker, expired)
+                )
+            ]
+            self._db.executemany(
+                "DELETE FROM outbox_jobs WHERE event_id = ? AND worker = ?", [(e, self.worker) for e in events]
+            )
+            self._db.execute("DELETE FROM outbox_events WHERE worker = ? AND created < ?", (self.worker, expired))
+        return events
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,196 @@
+import asyncio
+import time
+from functools import partial
+from typing import Awaitable, Callable, Optional
+
+from discord.ext import tasks
+
+import api_handler
+import metrics
+import startup
+from __init__ import POLL_INTERVALS, POLL_PRE_MATCH_LEAD, POLL_INTERMISSION_AFTER, POLL_MAX_BACKOFF
+from manifest import STREAM_EVENTS
+from models import BaseEmbed, DiscException
+from scheduler import PollScheduler
+from stream import LiveStream
+from teams import TEAMS, Team
+
+
+class Poller:
+    """Poll HockeyData (and listen to the live streams) for all teams and pass on what should be posted.
+
+    It runs inside the bot, or on its own in a poller process that writes to the event log for the workers.
+    """
+
+    def __init__(
+        self,
+        send_embed: Callable[[Team, BaseEmbed], Awaitable[None]],
+        set_presence: Callable[[str], Awaitable[None]],
+        update_card: Callable[[Team, BaseEmbed], Awaitable[None]],
+    ) -> None:
+        self.send_embed = send_embed
+        self._set_presence = set_presence
+        self._update_card = update_card
+        self.presence = None
+        # What the live card of each team last showed, so it's only passed on when it changes
+        self.cards: dict[str, tuple] = {}
+        self.active_matches = {key: False for key in TEAMS}
+        self.schedulers = {
+            key: PollScheduler(POLL_INTERVALS, POLL_PRE_MATCH_LEAD, POLL_INTERMISSION_AFTER, POLL_MAX_BACKOFF)
+            for key in TEAMS
+        }
+        self.streams = {
+            key: LiveStream(
+                api_handler.client,
+                team.stream_url,
+                team.api_key,
+                STREAM_EVENTS,
+                on_event=partial(self.on_stream_event, team),
+                on_disconnect=self.on_stream_disconnect,
+            )
+            for key, team in TEAMS.items()
+            if team.stream_url
+        }
+        self._stream_tasks = []
+        # Updates are triggered by both the poll loop and the live streams, but must never run at the same time
+        self._update_lock = asyncio.Lock()
+        # When the loop is expected to run next, to measure how late it is
+        self._next_poll = None
+
+    def start_streams(self) -> None:
+        self._stream_tasks = [asyncio.create_task(stream.run()) for stream in self.streams.values()]
+
+    async def _update(self):
+        async with self._update_lock:
+            # Live data of teams playing each other is shared, so it's only fetched once for both
+            updates = [self.update_team(team) for team in TEAMS.values()]
+            results = await asyncio.gather(*updates, return_exceptions=True)
+            for team, result in zip(TEAMS.values(), results):
+                if isinstance(result, Exception):
+                    # Don't let an unexpected response stop the loop, just back off and try again
+                    print(f"Update of {team.key} failed: {result!r}")
+                    self.schedulers[team.key].record_error()
+            await self.update_presence()
+
+    async def update_team(self, team: Team) -> None:
+        was_active = self.active_matches[team.key]
+        match_status = await self.get_match_status(team)
+        # A match that just started is announced before its first goals
+        if match_status and self.active_matches[team.key]:
+            await self.emit(team, match_status)
+            match_status = None
+        # Also right after the match ended, a goal may have been scored since the last poll (e.g. in overtime)
+        if self.active_matches[team.key] or was_active:
+            await self.get_score(team)
+        if match_status:
+            await self.emit(team, match_status)
+        # The card is updated one last time when the match ends
+        if self.active_matches[team.key] or was_active:
+            await self.update_card(team)
+
+    async def on_stream_event(self, team: Team, name: str, body: bytes) -> None:
+        api_handler.feed(team, name, body)
+        try:
+            await self._update()
+        except Exception as e:
+            print(f"Update failed: {e!r}")
+
+    async def set_presence(self, presence: str) -> None:
+        # Only pass on the presence if the text changed
+        if presence == self.presence:
+            return
+        await self._set_presence(presence)
+        self.presence = presence
+
+    async def update_presence(self) -> None:
+        """Show the score of the first team playing a match, otherwise cheer for all teams"""
+        for team in TEAMS.values():
+            if self.active_matches[team.key]:
+                try:
+                    await self.set_presence(f"{await api_handler.get_presence_string(team)}")
+                    return
+                except DiscException:
+                    pass
+        await self.set_presence(f"Forza {' & '.join(team.displayed_name for team in TEAMS.values())}! 🥅🏒")
+
+    async def update_card(self, team: Team) -> None:
+        try:
+            card = await api_handler.get_live_card(team)
+        except DiscException:
+            return
+        shown = (card.event_id, card.title_key, card.values)
+        if shown == self.cards.get(team.key):
+            return
+        self.cards[team.key] = shown
+        await self._update_card(team, card)
+
+    async def get_match_status(self, team: Team) -> Optional[BaseEmbed]:
+        """Get the current match status of a team, and the embed to send if the match just started or ended"""
+        try:
+            match_status = await api_handler.get_match_status(team)
+        except DiscException:
+            self.active_matches[team.key] = False
+            self.schedulers[team.key].record_error()
+            return None
+        self.schedulers[team.key].record_success()
+        self.active_matches[team.key] = bool(match_status.extra_data.get("active_match"))
+
+        # The embed only has a title key at the start or end of a match
+        return match_status if match_status.title_key else None
+
+    async def get_score(self, team: Team):
+        try:
+            goals = await api_handler.get_goals(team)
+        except DiscException:
+            return
+        # One message per goal, in the order they were scored
+        for goal in goals:
+            await self.emit(team, goal)
+
+    async def emit(self, team: Team, disc_embed: BaseEmbed) -> None:
+        metrics.trace(
+            "detected",
+            event_id=disc_embed.event_id,
+            team=team.key,
+            event=disc_embed.title_key,
+            # The embed is created when the change is detected, everything after that is fetching and preparing images
+            render_seconds=time.time() - disc_embed.detected_at,
+        )
+        await self.send_embed(team, disc_embed)
+
+    def on_stream_disconnect(self) -> None:
+        # The loop may be sleeping for a long time since the stream was connected, so poll right away instead
+        if self._loop.is_running() and not self._update_lock.locked():
+            self._loop.restart()
+
+    async def close(self) -> None:
+        self._loop.cancel()
+        for task in self._stream_tasks:
+            task.cancel()
+
+    def next_delay(self, team: Team) -> float:
+        state = api_handler.states[team.key]
+        stream = self.streams.get(team.key)
+        streaming = stream is not None and stream.connected
+        return self.schedulers[team.key].next_delay(state.status, state.start, state.changed_at, streaming=streaming)
+
+    @tasks.loop(seconds=POLL_INTERVALS["live"])
+    async def _loop(self):
+        started = time.monotonic()
+        if self._next_poll is not None:
+            # Polls restarted early by a stream disconnect aren't late
+            metrics.POLL_LAG.observe(max(0.0, started - self._next_poll))
+        try:
+            with metrics.POLL_DURATION.time():
+                await self._update()
+        except Exception as e:
+            print(f"Update failed: {e!r}")
+        if self._next_poll is None:
+            startup.mark("first_poll")
+            startup.report()
+
+        # Poll as often as the team that needs it most
+        delay = min(self.next_delay(team) for team in TEAMS.values())
+        self._loop.change_interval(seconds=delay)
+        # The loop waits from the start of the previous iteration
+        self._next_poll = started + delay
@@ -0,0 +1,70 @@
+import base64
+import json
+import os
+import time
+from typing import Optional
+
+
+class Recorder:
+    """Append every HockeyData response to a jsonl file, so a match can be replayed later with tools/replay.py.
+
+    A body is only written when it differs from the last one of the endpoint, so polling an unchanged match adds a
+    few bytes per poll. Every time the file is opened a "meta" line is written first, describing the teams.
+    """
+
+    def __init__(self, path: str, meta: dict) -> None:
+        self.path = path
+        self.meta = meta
+        self._file = None
+        self._digests: dict[str, str] = {}
+
+    def _write(self, record: dict) -> None:
+        if self._file is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(json.dumps({"t": time.time(), "meta": self.meta}, separators=(",", ":")) + "\n")
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def record(self, endpoint: str, status: int, body: bytes, digest: str) -> None:
+        record = {"t": time.time(), "endpoint": endpoint, "status": status}
+        # 304s have no body, and a body that didn't change is the one written last for the endpoint
+        if status == 200 and self._digests.get(endpoint) != digest:
+            self._digests[endpoint] = digest
+            try:
+                record["body"] = body.decode("utf-8")
+            except UnicodeDecodeError:
+                record["body_base64"] = base64.b64encode(body).decode("ascii")
+        self._write(record)
+
+    def record_error(self, endpoint: str, error: Exception) -> None:
+        self._write({"t": time.time(), "endpoint": endpoint, "error": type(error).__name__})
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load(path: str) -> tuple[dict, list[dict]]:
+    """Read a recording, returning the meta of the first session and the records with every body filled in"""
+    meta: Optional[dict] = None
+    records = []
+    bodies: dict[str, bytes] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if "meta" in record:
+                meta = meta or record["meta"]
+                # The digests start over with every session
+                bodies.clear()
+                continue
+            endpoint = record["endpoint"]
+            if "body" in record:
+                bodies[endpoint] = record["body"].encode("utf-8")
+            elif "body_base64" in record:
+                bodies[endpoint] = base64.b64decode(record["body_base64"])
+            if record.get("status") == 200:
+                record["body"] = bodies.get(endpoint, b"")
+            records.append(record)
+    return meta or {}, records
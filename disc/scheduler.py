@@ -0,0 +1,63 @@
+import random
+import time
+from datetime import datetime
+from typing import Optional
+
+from models import MatchStatus
+
+
+class PollScheduler:
+    """Decide how long to wait until the next poll, based on the state of the match.
+
+    HockeyData has no intermission flag, so a live match where the score payload hasn't changed for
+    `intermission_after` seconds is polled at the (slower) intermission interval until it changes again.
+    """
+
+    def __init__(
+        self,
+        intervals: dict[str, float],
+        pre_match_lead: float,
+        intermission_after: float,
+        max_backoff: float,
+    ) -> None:
+        self.intervals = intervals
+        self.pre_match_lead = pre_match_lead
+        self.intermission_after = intermission_after
+        self.max_backoff = max_backoff
+        self.errors = 0
+
+    def record_success(self) -> None:
+        self.errors = 0
+
+    def record_error(self) -> None:
+        self.errors += 1
+
+    def phase(self, status: str, start: Optional[str], changed_at: float) -> str:
+        if status == MatchStatus.InProgress.value:
+            if time.time() - changed_at > self.intermission_after:
+                return "intermission"
+            return "live"
+        if status in (MatchStatus.Finished.value, MatchStatus.Aborted.value):
+            return "finished"
+        if start and self._until_start(start) <= self.pre_match_lead:
+            return "pre_match"
+        return "idle"
+
+    @staticmethod
+    def _until_start(start: str) -> float:
+        return datetime.fromisoformat(start).timestamp() - time.time()
+
+    def next_delay(self, status: str, start: Optional[str], changed_at: float, streaming: bool = False) -> float:
+        """Seconds until the next poll"""
+        phase = self.phase(status, start, changed_at)
+        delay = self.intervals[phase]
+        if phase == "idle" and start:
+            # Sleep until shortly before the puck drops, but check now and then in case the match is moved
+            delay = min(delay, max(self._until_start(start) - self.pre_match_lead, self.intervals["pre_match"]))
+        if streaming:
+            # Updates are pushed by the live stream, so polling is only a safety net
+            delay = max(delay, self.intervals["streaming"])
+        if self.errors:
+            # Exponential backoff with full jitter, starting at the interval of the current phase
+            delay = random.uniform(delay, max(delay, min(self.max_backoff, delay * 2**self.errors)))
+        return delay
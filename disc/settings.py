@@ -0,0 +1,182 @@
+import os
+from dataclasses import dataclass, field
+from typing import Mapping, Optional
+
+ROLES = ("all", "poller", "worker")
+
+
+class SettingsError(ValueError):
+    def __init__(self, problems: list[str]) -> None:
+        super().__init__("Invalid settings:\n" + "\n".join(f"- {problem}" for problem in problems))
+        self.problems = problems
+
+
+class _Reader:
+    """Reads values from the environment, collecting the ones that can't be parsed instead of raising right away"""
+
+    def __init__(self, env: Mapping[str, str]) -> None:
+        self.env = env
+        self.errors: list[str] = []
+
+    def text(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.env.get(name, default)
+
+    def number(self, name: str, default: Optional[float], parse: type = float) -> Optional[float]:
+        value = self.env.get(name)
+        if not value:
+            return default
+        try:
+            return parse(value)
+        except ValueError:
+            self.errors.append(f"{name} must be a number, not {value!r}")
+            return default
+
+    def flag(self, name: str) -> bool:
+        value = self.env.get(name, "").lower()
+        if value not in ("", "0", "false", "no", "1", "true", "yes"):
+            self.errors.append(f"{name} must be true or false, not {self.env[name]!r}")
+        return value in ("1", "true", "yes")
+
+    def shard_ids(self, name: str) -> Optional[list[int]]:
+        # Comma separated shard ids and ranges (e.g. "0-3,8")
+        try:
+            return [
+                shard_id
+                for part in self.env.get(name, "").split(",")
+                if part
+                for shard_id in range(int(part.split("-")[0]), int(part.split("-")[-1]) + 1)
+            ] or None
+        except ValueError:
+            self.errors.append(f"{name} must be shard ids and ranges like 0-3,8, not {self.env[name]!r}")
+            return None
+
+
+@dataclass(frozen=True)
+class Settings:
+    """All configuration, read once from the environment when the bot is imported and checked by `validate` when
+    it starts, so importing a module never fails because of the configuration"""
+
+    discord_token: Optional[str]
+    hockeydata_host: Optional[str]
+    hockeydata_api_key: Optional[str]
+    hockeydata_stream_url: Optional[str]
+    hockeydata_team_name: list[str]
+    displayed_team_name: Optional[str]
+    team_key: str
+    teams_file: Optional[str]
+    language: str
+    delivery_concurrency: int
+    image_workers: int
+    response_cache_mb: float
+    image_cache_mb: float
+    hockeydata_cache_mb: float
+    role: str
+    shard_count: Optional[int]
+    shard_ids: Optional[list[int]]
+    event_log_interval: float
+    live_card_interval: float
+    leader_election: bool
+    lease_duration: float
+    metrics_host: str
+    metrics_port: Optional[int]
+    metrics_trace_file: Optional[str]
+    hockeydata_record_file: Optional[str]
+    poll_intervals: dict[str, float]
+    poll_pre_match_lead: float
+    poll_intermission_after: float
+    poll_max_backoff: float
+    # Values that couldn't be parsed, their defaults are used until validate reports them
+    errors: list[str] = field(default_factory=list, compare=False)
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = os.environ) -> "Settings":
+        read = _Reader(env)
+        settings = cls(
+            discord_token=read.text("DISCORD_TOKEN"),
+            hockeydata_host=read.text("HOCKEYDATA_HOST"),
+            hockeydata_api_key=read.text("HOCKEYDATA_API_KEY"),
+            hockeydata_stream_url=read.text("HOCKEYDATA_STREAM_URL"),
+            hockeydata_team_name=read.text("HOCKEYDATA_TEAM_NAME", "").split(","),
+            displayed_team_name=read.text("DISPLAYED_TEAM_NAME"),
+            team_key=read.text("TEAM_KEY", "default"),
+            teams_file=read.text("TEAMS_FILE"),
+            language=read.text("LANGUAGE", "en"),
+            delivery_concurrency=read.number("DELIVERY_CONCURRENCY", 25, int),
+            image_workers=read.number("IMAGE_WORKERS", 2, int),
+            response_cache_mb=read.number("RESPONSE_CACHE_MB", 16),
+            image_cache_mb=read.number("IMAGE_CACHE_MB", 32),
+            hockeydata_cache_mb=read.number("HOCKEYDATA_CACHE_MB", 8),
+            role=read.text("ROLE", "all"),
+            shard_count=read.number("SHARD_COUNT", None, int),
+            shard_ids=read.shard_ids("SHARD_IDS"),
+            event_log_interval=read.number("EVENT_LOG_INTERVAL", 0.5),
+            live_card_interval=read.number("LIVE_CARD_INTERVAL", 5),
+            leader_election=read.flag("LEADER_ELECTION"),
+            lease_duration=read.number("LEASE_DURATION", 1),
+            metrics_host=read.text("METRICS_HOST", "127.0.0.1"),
+            metrics_port=read.number("METRICS_PORT", None, int),
+            metrics_trace_file=read.text("METRICS_TRACE_FILE"),
+            hockeydata_record_file=read.text("HOCKEYDATA_RECORD_FILE"),
+            poll_intervals={
+                "live": read.number("POLL_INTERVAL_LIVE", 2),
+                "intermission": read.number("POLL_INTERVAL_INTERMISSION", 5),
+                "pre_match": read.number("POLL_INTERVAL_PRE_MATCH", 10),
+                "finished": read.number("POLL_INTERVAL_FINISHED", 600),
+                "idle": read.number("POLL_INTERVAL_IDLE", 3600),
+                "streaming": read.number("POLL_INTERVAL_STREAMING", 30),
+            },
+            poll_pre_match_lead=read.number("POLL_PRE_MATCH_LEAD", 900),
+            poll_intermission_after=read.number("POLL_INTERMISSION_AFTER", 180),
+            poll_max_backoff=read.number("POLL_MAX_BACKOFF", 300),
+        )
+        settings.errors.extend(read.errors)
+        return settings
+
+    def validate(self) -> None:
+        """Raise a SettingsError listing every problem, so they can all be fixed at once"""
+        problems = list(self.errors)
+        if self.role not in ROLES:
+            problems.append(f"ROLE must be one of {', '.join(ROLES)}, not {self.role!r}")
+        if self.role != "poller" and not self.discord_token:
+            problems.append("DISCORD_TOKEN is required")
+        if self.teams_file:
+            # Imported here, teams imports the settings
+            from teams import read_teams_file
+
+            try:
+                if not read_teams_file(self.teams_file):
+                    problems.append(f"TEAMS_FILE {self.teams_file} must list at least one team")
+            except SettingsError as e:
+                problems.extend(e.problems)
+            except OSError as e:
+                problems.append(f"TEAMS_FILE {self.teams_file} can't be read: {e.strerror}")
+            except ValueError as e:
+                problems.append(f"TEAMS_FILE {self.teams_file} isn't valid json: {e}")
+        else:
+            # Without a teams file the single team is configured by the environment
+            for name, value in [
+                ("HOCKEYDATA_HOST", self.hockeydata_host),
+                ("HOCKEYDATA_TEAM_NAME", any(self.hockeydata_team_name)),
+                ("DISPLAYED_TEAM_NAME", self.displayed_team_name),
+            ]:
+                if not value:
+                    problems.append(f"{name} is required unless TEAMS_FILE is set")
+        if self.shard_ids and not self.shard_count:
+            problems.append("SHARD_COUNT is required when SHARD_IDS is set")
+        if self.shard_ids and self.shard_count and max(self.shard_ids) >= self.shard_count:
+            problems.append(f"SHARD_IDS must be below SHARD_COUNT ({self.shard_count})")
+        for name, value in [
+            ("DELIVERY_CONCURRENCY", self.delivery_concurrency),
+            ("IMAGE_WORKERS", self.image_workers),
+            ("RESPONSE_CACHE_MB", self.response_cache_mb),
+            ("IMAGE_CACHE_MB", self.image_cache_mb),
+            ("HOCKEYDATA_CACHE_MB", self.hockeydata_cache_mb),
+            ("EVENT_LOG_INTERVAL", self.event_log_interval),
+            ("LIVE_CARD_INTERVAL", self.live_card_interval),
+            ("LEASE_DURATION", self.lease_duration),
+            *((f"POLL_INTERVAL_{phase.upper()}", interval) for phase, interval in self.poll_intervals.items()),
+        ]:
+            if value <= 0:
+                problems.append(f"{name} must be positive")
+        if problems:
+            raise SettingsError(problems)
@@ -0,0 +1,27 @@
+import time
+
+# Imported first by main.py, so this is as close to the start of the process as we can measure
+STARTED = time.perf_counter()
+
+# Seconds spent in each phase of the startup, in order
+phases: dict[str, float] = {}
+_last = STARTED
+_reported = False
+
+
+def mark(phase: str) -> None:
+    """End a phase, which started when the previous one ended"""
+    global _last
+    now = time.perf_counter()
+    phases[phase] = now - _last
+    _last = now
+
+
+def report() -> None:
+    """Print the time of every phase and the total, once"""
+    global _reported
+    if _reported:
+        return
+    _reported = True
+    phases["total"] = _last - STARTED
+    print("Started in " + ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in phases.items()))
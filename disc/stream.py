@@ -0,0 +1,86 @@
+import asyncio
+import random
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+
+from hockeydata import HockeyDataClient
+
+
+class LiveStream:
+    """Listen to a Server-Sent Events feed of live HockeyData updates.
+
+    Every event carries the same payload as the endpoint it is mapped to in `events`, e.g. `event: score` carries the
+    body of the "score" endpoint. The stream reconnects with backoff and resumes from the last event id it received.
+    """
+
+    def __init__(
+        self,
+        client: HockeyDataClient,
+        url: str,
+        api_key: str,
+        events: dict[str, str],
+        on_event: Callable[[str, bytes], Awaitable[None]],
+        on_disconnect: Callable[[], None] = None,
+        read_timeout: float = 60,
+        max_backoff: float = 60,
+    ) -> None:
+        self.client = client
+        self.url = url
+        self.api_key = api_key
+        self.events = events
+        self.on_event = on_event
+        self.on_disconnect = on_disconnect
+        self.read_timeout = read_timeout
+        self.max_backoff = max_backoff
+        self.connected = False
+        self.last_event_id: Optional[str] = None
+        self._retry = 1.0
+
+    async def run(self) -> None:
+        attempt = 0
+        while True:
+            try:
+                await self._listen()
+                attempt = 0
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                print(f"Live stream disconnected: {e!r}")
+                attempt += 1
+
+            was_connected, self.connected = self.connected, False
+            if was_connected and self.on_disconnect:
+                self.on_disconnect()
+            await asyncio.sleep(random.uniform(self._retry, min(self.max_backoff, self._retry * 2**attempt)))
+
+    async def _listen(self) -> None:
+        headers = {"Accept": "text/event-stream", "HockeyData-API-Key": self.api_key or ""}
+        if self.last_event_id:
+            headers["Last-Event-ID"] = self.last_event_id
+        # The stream is open for as long as the server allows, only a silent connection counts as timed out
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=self.read_timeout)
+
+        async with self.client.session.get(self.url, headers=headers, timeout=timeout) as r:
+            self.connected = True
+            event, data, event_id = "", [], None
+            async for raw_line in r.content:
+                line = raw_line.decode("utf-8").rstrip("\r\n")
+                if not line:
+                    if data and event in self.events:
+                        await self.on_event(self.events[event], "\n".join(data).encode("utf-8"))
+                    if event_id is not None:
+                        self.last_event_id = event_id
+                    event, data, event_id = "", [], None
+                    continue
+                if line.startswith(":"):
+                    continue  # Comments are used as keep-alives
+
+                field, _, value = line.partition(":")
+                value = value.removeprefix(" ")
+                if field == "event":
+                    event = value
+                elif field == "data":
+                    data.append(value)
+                elif field == "id":
+                    event_id = value
+                elif field == "retry" and value.isdigit():
+                    self._retry = int(value) / 1000
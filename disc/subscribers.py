@@ -1,63 +1,178 @@
 import json
 import os
+import sqlite3
+from types import MappingProxyType
+from typing import Mapping, Optional
 
 from __init__ import LANGUAGE
+from teams import DEFAULT_TEAM
+
+DATABASE = "data/subscribers.db"
+LEGACY_FILE = "data/subscribers.json"
+
+_db: sqlite3.Connection = None
+# All subscriptions are kept in memory by team and channel, the database is only written to
+_subscriptions: dict[str, dict[str, dict]] = {}
 
 
 def initialize() -> None:
+    global _db
     if not os.path.exists("data"):
         os.mkdir("data")
-    if not os.path.exists("data/subscribers.json"):
-        with open("data/subscribers.json", "w", encoding="utf-8") as f:
-            json.dump({}, f)
 
-
-def get_channels() -> dict:
-    # TODO: Use a database instead of a json file
-    with open("data/subscribers.json", encoding="utf-8") as f:
+    # Autocommit mode, so every statement is its own atomic transaction
+    _db = sqlite3.connect(DATABASE, isolation_level=None)
+    _db.execute("PRAGMA journal_mode=WAL")
+    _db.execute("PRAGMA synchronous=NORMAL")
+    _db.execute(
+        "CREATE TABLE IF NOT EXISTS subscriptions "
+        "(channel_id TEXT NOT NULL, team TEXT NOT NULL, lang TEXT NOT NULL, guild_id INTEGER, "
+        "live_card INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (channel_id, team))"
+    )
+    _migrate_guild_column()
+    _migrate_live_card_column()
+    _migrate_single_team_table()
+    _migrate_legacy_file()
+    reload()
+
+
+def reload() -> None:
+    """Read all subscriptions from the database again, so a standby replica sees the changes made by the leader"""
+    subscriptions = {}
+    for channel_id, team, lang, guild_id, live_card in _db.execute(
+        "SELECT channel_id, team, lang, guild_id, live_card FROM subscriptions"
+    ):
+        subscriptions.setdefault(team, {})[channel_id] = {
+            "lang": lang,
+            "guild_id": guild_id,
+            "live_card": bool(live_card),
+        }
+    _subscriptions.clear()
+    _subscriptions.update(subscriptions)
+
+
+def _migrate_guild_column() -> None:
+    """Add the guild of the channel, which is unknown (NULL) for subscriptions made before it was stored"""
+    columns = [row[1] for row in _db.execute("PRAGMA table_info(subscriptions)")]
+    if "guild_id" not in columns:
+        _db.execute("ALTER TABLE subscriptions ADD COLUMN guild_id INTEGER")
+
+
+def _migrate_live_card_column() -> None:
+    """Add whether the channel gets a single live card per match, which is off for existing subscriptions"""
+    columns = [row[1] for row in _db.execute("PRAGMA table_info(subscriptions)")]
+    if "live_card" not in columns:
+        _db.execute("ALTER TABLE subscriptions ADD COLUMN live_card INTEGER NOT NULL DEFAULT 0")
+
+
+def _migrate_single_team_table() -> None:
+    """Move the subscribers from before there were multiple teams to the first team"""
+    if not _db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'subscribers'").fetchone():
+        return
+    with _db:
+        _db.execute("BEGIN")
+        _db.execute(
+            "INSERT OR IGNORE INTO subscriptions (channel_id, team, lang) SELECT channel_id, ?, lang FROM subscribers",
+            (DEFAULT_TEAM.key,),
+        )
+        _db.execute("DROP TABLE subscribers")
+
+
+def _migrate_legacy_file() -> None:
+    """Move the subscribers from the old json file into the database (only happens once)"""
+    if not os.path.exists(LEGACY_FILE):
+        return
+    with open(LEGACY_FILE, encoding="utf-8") as f:
         data = json.load(f)
-    return data
+    with _db:
+        _db.execute("BEGIN")
+        _db.executemany(
+            "INSERT OR IGNORE INTO subscriptions (channel_id, team, lang) VALUES (?, ?, ?)",
+            [(channel_id, DEFAULT_TEAM.key, settings.get("lang", LANGUAGE)) for channel_id, settings in data.items()],
+        )
+    os.replace(LEGACY_FILE, f"{LEGACY_FILE}.migrated")
+
+
+def get_channels(team: str) -> Mapping[str, dict]:
+    """Read-only view of all channels subscribed to a team"""
+    return MappingProxyType(_subscriptions.setdefault(team, {}))
+
+
+def get_subscribed_channels() -> set[str]:
+    """All channels subscribed to at least one team"""
+    return set().union(*_subscriptions.values())
+
+
+def get_teams(channel_id: str) -> list[str]:
+    """The teams a channel is subscribed to"""
+    channel_id = str(channel_id)
+    return [team for team, channels in _subscriptions.items() if channel_id in channels]
 
 
 def get_settings(channel_id: str) -> dict:
-    # TODO: Use a database instead of a json file
     channel_id = str(channel_id)
-    with open("data/subscribers.json", encoding="utf-8") as f:
-        data = json.load(f)
-    return data.get(channel_id, {"lang": LANGUAGE})
+    for channels in _subscriptions.values():
+        if channel_id in channels:
+            return channels[channel_id]
+    return {"lang": LANGUAGE}
 
 
 def set_lang(channel_id: str, lang: str) -> None:
+    """Change the language of all subscriptions of a channel"""
     channel_id = str(channel_id)
-    with open("data/subscribers.json", encoding="utf-8") as f:
-        data = json.load(f)
-    data[channel_id]["lang"] = lang
-    with open("data/subscribers.json", "w", encoding="utf-8") as f:
-        json.dump(data, f)
+    _db.execute("UPDATE subscriptions SET lang = ? WHERE channel_id = ?", (lang, channel_id))
+    for channels in _subscriptions.values():
+        if channel_id in channels:
+            channels[channel_id]["lang"] = lang
 
 
-def toggle(channel_id: str, lang=LANGUAGE) -> bool:
-    # TODO: Use a database instead of a json file
+def set_guild(channel_id: str, guild_id: int) -> None:
+    """Store the guild of a channel that was subscribed before guild ids were stored"""
     channel_id = str(channel_id)
-    new_subscriber = True
-    with open("data/subscribers.json", encoding="utf-8") as f:
-        data = json.load(f)
+    _db.execute("UPDATE subscriptions SET guild_id = ? WHERE channel_id = ?", (guild_id, channel_id))
+    for channels in _subscriptions.values():
+        if channel_id in channels:
+            channels[channel_id]["guild_id"] = guild_id
 
-    # If the key "channel_id" exists in the dictionary, remove it
-    if str(channel_id) in data.keys():
-        data.pop(channel_id)
-        new_subscriber = False
-    else:
-        data[channel_id] = dict({"lang": lang})
-    with open("data/subscribers.json", "w", encoding="utf-8") as f:
-        json.dump(data, f)
-    return new_subscriber
 
+def set_live_card(channel_id: str, enabled: bool) -> None:
+    """Switch all subscriptions of a channel between a message per event and a single live card per match"""
+    channel_id = str(channel_id)
+    _db.execute("UPDATE subscriptions SET live_card = ? WHERE channel_id = ?", (int(enabled), channel_id))
+    for channels in _subscriptions.values():
+        if channel_id in channels:
+            channels[channel_id]["live_card"] = enabled
 
-def get_lang(channel_id: str) -> str:
+
+def remove_channel(channel_id: str) -> None:
+    """Remove all subscriptions of a channel, e.g. when it was deleted"""
     channel_id = str(channel_id)
-    settings = get_settings(channel_id)
-    return settings.get("lang", "en")
+    _db.execute("DELETE FROM subscriptions WHERE channel_id = ?", (channel_id,))
+    for channels in _subscriptions.values():
+        channels.pop(channel_id, None)
+
 
+def toggle(channel_id: str, team: str = DEFAULT_TEAM.key, lang=LANGUAGE, guild_id: Optional[int] = None) -> bool:
+    channel_id = str(channel_id)
+    channels = _subscriptions.setdefault(team, {})
 
-initialize()
+    # If the channel is already subscribed, remove it
+    if channel_id in channels:
+        _db.execute("DELETE FROM subscriptions WHERE channel_id = ? AND team = ?", (channel_id, team))
+        channels.pop(channel_id)
+        return False
+
+    # A channel using live cards gets them for every team it subscribes to
+    live_card = get_settings(channel_id).get("live_card", False)
+    _db.execute(
+        "INSERT INTO subscriptions (channel_id, team, lang, guild_id, live_card) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (channel_id, team) DO UPDATE SET lang = excluded.lang, guild_id = excluded.guild_id",
+        (channel_id, team, lang, guild_id, int(live_card)),
+    )
+    channels[channel_id] = {"lang": lang, "guild_id": guild_id, "live_card": live_card}
+    return True
+
+
+def get_lang(channel_id: str) -> str:
+    settings = get_settings(channel_id)
+    return settings.get("lang", "en")
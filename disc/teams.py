@@ -0,0 +1,69 @@
+import json
+from dataclasses import dataclass, field
+from typing import Optional
+
+from __init__ import (
+    DISPLAYED_TEAM_NAME,
+    HOCKEYDATA_API_KEY,
+    HOCKEYDATA_HOST,
+    HOCKEYDATA_STREAM_URL,
+    HOCKEYDATA_TEAM_NAME,
+    TEAM_KEY,
+    TEAMS_FILE,
+)
+from settings import SettingsError
+
+
+@dataclass(frozen=True)
+class Team:
+    key: str  # Used to store subscriptions and match state
+    hockeydata_names: tuple[str, ...]  # The (full) team names as they appear in the response data
+    displayed_name: str
+    host: str = HOCKEYDATA_HOST
+    api_key: str = field(default=HOCKEYDATA_API_KEY, repr=False)
+    stream_url: Optional[str] = None
+
+    @property
+    def possessive(self) -> str:
+        return f"{self.displayed_name}'s" if self.displayed_name[-1] != "s" else f"{self.displayed_name}'"
+
+
+def read_teams_file(path: str) -> dict[str, Team]:
+    """Build the teams listed in a teams file, raises a SettingsError for a team with missing or unknown fields"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    teams = {}
+    try:
+        for config in data:
+            config["hockeydata_names"] = tuple(config["hockeydata_names"])
+            team = Team(**config)
+            teams[team.key] = team
+    except (TypeError, KeyError) as e:
+        raise SettingsError([f"TEAMS_FILE {path} has an invalid team: {e!r}"]) from e
+    return teams
+
+
+def load_teams() -> dict[str, Team]:
+    """Load all teams from TEAMS_FILE, or the single team configured in the environment if it isn't set"""
+    if TEAMS_FILE:
+        # Anything wrong with the file (including an invalid team) is reported by Settings.validate when the bot
+        # starts, importing never fails because of it
+        try:
+            teams = read_teams_file(TEAMS_FILE)
+        except (OSError, ValueError):
+            teams = None
+        if teams:
+            return teams
+
+    team = Team(
+        key=TEAM_KEY,
+        hockeydata_names=tuple(HOCKEYDATA_TEAM_NAME),
+        displayed_name=DISPLAYED_TEAM_NAME,
+        stream_url=HOCKEYDATA_STREAM_URL,
+    )
+    return {team.key: team}
+
+
+TEAMS = load_teams()
+# Subscriptions from before there were multiple teams belong to the first team
+DEFAULT_TEAM = next(iter(TEAMS.values()))
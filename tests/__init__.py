@@ -0,0 +1,24 @@
+"""Run from the repository root with `python -m unittest discover -s tests -t .` (or pytest).
+
+The modules of the bot import each other by name, like they do when run from the disc directory, and read their
+settings from the environment when imported, so both are set up here before any test imports them.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+DISC_DIRECTORY = Path(__file__).resolve().parent.parent / "disc"
+sys.path.insert(0, str(DISC_DIRECTORY))
+
+# A single team configured by the environment, whatever the .env of the checkout says
+os.environ.update(
+    HOCKEYDATA_HOST="http://hockeydata.invalid",
+    HOCKEYDATA_API_KEY="key",
+    HOCKEYDATA_TEAM_NAME="Team A",
+    DISPLAYED_TEAM_NAME="Team A",
+    TEAM_KEY="default",
+    TEAMS_FILE="",
+    HOCKEYDATA_RECORD_FILE="",
+    METRICS_PORT="",
+)
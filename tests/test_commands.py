@@ -0,0 +1,54 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import api_handler
+import commands
+from catalog import CATALOG
+from models import DiscEmbed
+
+
+def _context(deferred: bool) -> mock.Mock:
+    ctx = mock.Mock()
+    ctx.channel.id = 1
+    ctx.response.defer = mock.AsyncMock()
+    ctx.response.send_message = mock.AsyncMock()
+    ctx.response.is_done.return_value = deferred
+    ctx.followup.send = mock.AsyncMock()
+    return ctx
+
+
+class NextMatchTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        for patch in (
+            mock.patch.object(commands.subscribers, "get_lang", return_value="en"),
+            mock.patch.object(commands.subscribers, "get_teams", return_value=[]),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def next_match(self, ctx: mock.Mock, cached: bool, card) -> None:
+        with (
+            mock.patch.object(api_handler, "has_next_match_card", return_value=cached),
+            mock.patch.object(api_handler, "get_next_match_card", side_effect=[card]),
+        ):
+            await commands.next_match.callback(ctx)
+
+    async def test_failure_after_deferring_is_answered(self) -> None:
+        ctx = _context(deferred=True)
+        await self.next_match(ctx, cached=False, card=asyncio.TimeoutError())
+        ctx.response.defer.assert_awaited_once()
+        ctx.followup.send.assert_awaited_once_with(CATALOG.render("en", "next_match_failed"), ephemeral=False)
+
+    async def test_cached_card_is_rendered_for_every_reply(self) -> None:
+        card = DiscEmbed(title_key="next_match_title", description_key="next_match", values={})
+        ctx = _context(deferred=False)
+        await self.next_match(ctx, cached=True, card=card)
+        await self.next_match(ctx, cached=True, card=card)
+        first, second = (call.kwargs["embed"] for call in ctx.response.send_message.await_args_list)
+        self.assertIsNot(first, second)
+        ctx.response.defer.assert_not_awaited()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import tempfile
+import unittest
+
+from image_cache import CachedImage, ImageCache
+
+
+class ImageCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    async def test_read_back_from_disk(self) -> None:
+        image = CachedImage(data=b"image", etag='"1"', validated_at=10.0)
+        await ImageCache(self.directory).put(("team", "A"), image)
+        self.assertEqual(await ImageCache(self.directory).get(("team", "A")), image)
+        self.assertIsNone(await ImageCache(self.directory).get(("team", "B")))
+
+    async def test_image_larger_than_the_memory_cache(self) -> None:
+        image = CachedImage(data=b"x" * 100)
+        await ImageCache(self.directory, max_bytes=10).put(("team", "A"), image)
+        cache = ImageCache(self.directory, max_bytes=10)
+        self.assertEqual(await cache.get(("team", "A")), image)
+        self.assertEqual(cache.nbytes, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import unittest
+
+from match_state import LEGACY_MATCH_FILE, LEGACY_SCORE_FILE, STATE_FILE, MatchState
+from teams import DEFAULT_TEAM
+
+
+class LoadTest(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+        os.mkdir("data")
+
+    def write(self, path: str, data: dict) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    def test_legacy_files_are_migrated(self) -> None:
+        self.write(LEGACY_MATCH_FILE, {"status": "InProgress", "date": "2024-10-05T16:00:00+00:00"})
+        self.write(
+            LEGACY_SCORE_FILE,
+            {"team": {"score": 2, "team": "Team A"}, "opponent": {"score": 1, "team": "Team B"}},
+        )
+        state = MatchState(DEFAULT_TEAM)
+        state.load()
+        self.assertEqual(state.status, "InProgress")
+        self.assertEqual(state.start, "2024-10-05T16:00:00+00:00")
+        self.assertEqual(state.goal_count, 3)
+
+        # The next goal continues the numbering of the migrated match, instead of starting over at 1
+        goals = state.update_score({"score": 3, "team": "Team A"}, {"score": 1, "team": "Team B"})
+        self.assertEqual(goals, [("team", 3, 1)])
+        self.assertEqual(state.goal_count, 4)
+
+    def test_state_without_goal_count_counts_the_score(self) -> None:
+        score = {"team": {"score": 1, "team": "Team A"}, "opponent": {"score": 1, "team": "Team B"}}
+        self.write(STATE_FILE, {"status": "InProgress", "start": "2024-10-05T16:00:00+00:00", "score": score})
+        state = MatchState(DEFAULT_TEAM)
+        state.load()
+        self.assertEqual(state.goal_count, 2)
+
+    def test_goal_count_is_restored(self) -> None:
+        state = MatchState(DEFAULT_TEAM)
+        state.update_status("InProgress", "2024-10-05T16:00:00+00:00")
+        state.update_score({"score": 1, "team": "Team A"}, {"score": 0, "team": "Team B"})
+        # Overturned, the next goal still gets a new number
+        state.update_score({"score": 0, "team": "Team A"}, {"score": 0, "team": "Team B"})
+
+        loaded = MatchState(DEFAULT_TEAM)
+        loaded.load()
+        self.assertEqual(loaded.goal_count, 1)
+        self.assertEqual(loaded.start, "2024-10-05T16:00:00+00:00")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+
+import api_handler
+from models import DiscEmbed, DiscException
+from poller import Poller
+from teams import DEFAULT_TEAM
+
+
+def _status(title_key: str = None, active: bool = True) -> DiscEmbed:
+    return DiscEmbed(title_key=title_key, extra_data={"active_match": active}, event_id=title_key)
+
+
+def _goal(number: int) -> DiscEmbed:
+    return DiscEmbed(title_key="goal_home_title", event_id=f"goal:{number}")
+
+
+class UpdateTeamTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.sent = []
+
+        async def send_embed(team, disc_embed):
+            self.sent.append(disc_embed.event_id)
+
+        async def ignore(*_):
+            pass
+
+        self.poller = Poller(send_embed, ignore, ignore)
+        live_card = mock.patch.object(api_handler, "get_live_card", side_effect=DiscException)
+        live_card.start()
+        self.addCleanup(live_card.stop)
+
+    async def update(self, status: DiscEmbed, goals: list[DiscEmbed]) -> None:
+        with (
+            mock.patch.object(api_handler, "get_match_status", return_value=status),
+            mock.patch.object(api_handler, "get_goals", return_value=goals) as get_goals,
+        ):
+            await self.poller.update_team(DEFAULT_TEAM)
+        self.get_goals = get_goals
+
+    async def test_goal_with_match_end_is_sent_before_it(self) -> None:
+        self.poller.active_matches[DEFAULT_TEAM.key] = True
+        await self.update(_status("match_end_title", active=False), [_goal(4)])
+        self.assertEqual(self.sent, ["goal:4", "match_end_title"])
+
+    async def test_goal_with_match_start_is_sent_after_it(self) -> None:
+        await self.update(_status("match_start_title"), [_goal(1)])
+        self.assertEqual(self.sent, ["match_start_title", "goal:1"])
+
+    async def test_score_is_not_fetched_without_a_match(self) -> None:
+        await self.update(_status(active=False), [])
+        self.get_goals.assert_not_called()
+        self.assertEqual(self.sent, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import teams
+from settings import Settings, SettingsError
+
+
+class TeamsFileTest(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "teams.json")
+
+    def write(self, data) -> None:
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    def problems(self) -> list[str]:
+        try:
+            Settings.from_env({"DISCORD_TOKEN": "token", "TEAMS_FILE": self.path}).validate()
+        except SettingsError as e:
+            return e.problems
+        return []
+
+    def test_valid_file(self) -> None:
+        self.write([{"key": "a", "hockeydata_names": ["A"], "displayed_name": "A"}])
+        self.assertEqual(self.problems(), [])
+
+    def test_invalid_team_is_reported(self) -> None:
+        for team in ({"key": "a"}, {"key": "a", "hockeydata_names": ["A"], "displayed_name": "A", "colour": "red"}):
+            with self.subTest(team=team):
+                self.write([team])
+                [problem] = self.problems()
+                self.assertIn("has an invalid team", problem)
+
+    def test_empty_file_is_reported(self) -> None:
+        self.write([])
+        self.assertEqual(self.problems(), [f"TEAMS_FILE {self.path} must list at least one team"])
+
+    def test_loading_an_invalid_file_falls_back_to_the_environment(self) -> None:
+        self.write([{"key": "a"}])
+        with mock.patch.object(teams, "TEAMS_FILE", self.path):
+            self.assertEqual(list(teams.load_teams()), ["default"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,343 @@
+"""Fan-out benchmark of the bot against a fake HockeyData server and a fake Discord REST API.
+
+For every channel count a fresh bot process is started with that many subscribed channels. It runs the real poll
+loop of HockeyDisc, the match is started and a number of goals are scored, and the time until the first and the last
+channel received each message is measured. The fake Discord API answers after a configurable latency and with a
+configurable share of 429 responses.
+
+    python tools/benchmark.py --channels 10 100 10000 --output benchmarks/main.json
+    python tools/benchmark.py --channels 10 100 --compare benchmarks/main.json
+
+Results are saved as json, --compare prints the change of every metric against an earlier run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, UTC
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from fake_hockeydata import create_app as create_hockeydata_app
+
+HOME, AWAY = "Home Team", "Away Team"
+DISC_DIRECTORY = Path(__file__).resolve().parent.parent / "disc"
+# Metrics where a higher value is worse, used to flag regressions when comparing runs
+METRICS = ("start_first", "start_last", "goal_first", "goal_last", "cpu_time", "peak_memory_mb")
+
+USER = {"id": "1", "username": "disc", "discriminator": "0", "avatar": None, "global_name": None, "bot": True}
+
+
+def _json(data: dict | list, status: int = 200, headers: dict = None) -> web.Response:
+    # discord.py only decodes the body if the content type is exactly application/json, without a charset
+    headers = {"Content-Type": "application/json", **(headers or {})}
+    return web.Response(body=json.dumps(data).encode(), status=status, headers=headers)
+
+
+class FakeDiscord:
+    """Records every message sent to a channel, answering after `latency` seconds and with 429s at `rate_limited`"""
+
+    def __init__(self, latency: float, jitter: float, rate_limited: float) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limited = rate_limited
+        self.requests = 0
+        self.retries = 0
+        self.deliveries: list[float] = []
+
+    async def _respond_later(self) -> None:
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    async def user(self, request: web.Request) -> web.Response:
+        return _json(USER)
+
+    async def application(self, request: web.Request) -> web.Response:
+        return _json(
+            {
+                "id": "1",
+                "name": "disc",
+                "description": "",
+                "icon": None,
+                "bot_public": False,
+                "bot_require_code_grant": False,
+                "owner": USER,
+                "verify_key": "",
+                "flags": 0,
+            }
+        )
+
+    async def commands(self, request: web.Request) -> web.Response:
+        return _json([])
+
+    async def message(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await request.read()
+        await self._respond_later()
+        # One message per channel is sent for each event, so the per-channel bucket of 5 messages is never used up
+        headers = {
+            "X-RateLimit-Bucket": "channel-messages",
+            "X-RateLimit-Limit": "5",
+            "X-RateLimit-Remaining": "4",
+            "X-RateLimit-Reset": str(time.time() + 5),
+            "X-RateLimit-Reset-After": "5",
+        }
+        if random.random() < self.rate_limited:
+            self.retries += 1
+            retry_after = round(random.uniform(0.1, 1.0), 3)
+            return _json(
+                {"message": "You are being rate limited.", "retry_after": retry_after, "global": False},
+                status=429,
+                # discord.py treats a 429 without a Via header as a Cloudflare ban instead of retrying it
+                headers=headers | {"Retry-After": str(retry_after), "X-RateLimit-Scope": "user", "Via": "1.1 google"},
+            )
+
+        self.deliveries.append(time.time())
+        return _json(
+            {
+                "id": str(len(self.deliveries)),
+                "channel_id": request.match_info["channel_id"],
+                "type": 0,
+                "content": "",
+                "author": USER,
+                "attachments": [],
+                "embeds": [],
+                "mentions": [],
+                "mention_roles": [],
+                "pinned": False,
+                "mention_everyone": False,
+                "tts": False,
+                "timestamp": datetime.now(tz=UTC).isoformat(),
+                "edited_timestamp": None,
+                "flags": 0,
+            },
+            headers=headers,
+        )
+
+    async def stats(self, request: web.Request) -> web.Response:
+        deliveries = self.deliveries
+        return _json(
+            {
+                "requests": self.requests,
+                "retries": self.retries,
+                "messages": len(deliveries),
+                "first": min(deliveries, default=None),
+                "last": max(deliveries, default=None),
+            }
+        )
+
+    async def reset(self, request: web.Request) -> web.Response:
+        self.deliveries = []
+        return _json({})
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/api/v10/users/@me", self.user)
+        app.router.add_get("/api/v10/oauth2/applications/@me", self.application)
+        app.router.add_put("/api/v10/applications/{application_id}/commands", self.commands)
+        app.router.add_post("/api/v10/channels/{channel_id}/messages", self.message)
+        app.router.add_get("/bench/stats", self.stats)
+        app.router.add_post("/bench/reset", self.reset)
+        return app
+
+
+async def _start(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def _wait_for_messages(session: aiohttp.ClientSession, discord_url: str, count: int, timeout: float) -> dict:
+    """Wait until `count` messages were delivered since the last reset"""
+    deadline = time.monotonic() + timeout
+    while True:
+        async with session.get(f"{discord_url}/bench/stats") as response:
+            stats = await response.json()
+        if stats["messages"] >= count or time.monotonic() > deadline:
+            return stats
+        await asyncio.sleep(0.05)
+
+
+async def drive(channels: int, goals: int, hockeydata_url: str, discord_url: str) -> dict:
+    """Run the bot in this process with `channels` subscribed channels and measure a match"""
+    import discord
+
+    import api_handler
+    import subscribers
+    from main import client
+
+    subscribers.initialize()
+    for channel_id in range(1, channels + 1):
+        subscribers.toggle(str(channel_id))
+
+    discord.http.Route.BASE = f"{discord_url}/api/v10"
+    await client.login(os.environ["DISCORD_TOKEN"])
+    # The deliveries are spread out by the global rate limit, so allow enough time for every message
+    timeout = 30 + channels / client.delivery._limiter.rate * 2
+
+    results = {"channels": channels, "start_first": None, "start_last": None, "goal_first": [], "goal_last": []}
+    cpu_start, wall_start = time.process_time(), time.monotonic()
+    async with aiohttp.ClientSession() as session:
+        # Logging in started the poll loop, let it see the scheduled match first like it would before a real match
+        await asyncio.sleep(1)
+
+        for event in ["start"] + ["goal"] * goals:
+            await session.post(f"{discord_url}/bench/reset")
+            happened = time.time()
+            await session.post(f"{hockeydata_url}/control/{'start' if event == 'start' else 'goal/home'}")
+            # Poll right away, instead of waiting for the pre-match interval to pass
+            if event == "start":
+                client.poller._loop.restart()
+            stats = await _wait_for_messages(session, discord_url, channels, timeout)
+            if stats["messages"] < channels:
+                print(f"Only {stats['messages']} of {channels} messages were delivered", file=sys.stderr)
+            first = stats["first"] - happened if stats["first"] else None
+            last = stats["last"] - happened if stats["last"] else None
+            if event == "start":
+                results["start_first"], results["start_last"] = first, last
+            else:
+                results["goal_first"].append(first)
+                results["goal_last"].append(last)
+
+        async with session.get(f"{discord_url}/bench/stats") as response:
+            discord_stats = await response.json()
+        async with session.get(f"{hockeydata_url}/bench/stats") as response:
+            hockeydata_stats = await response.json()
+
+    minutes = (time.monotonic() - wall_start) / 60
+    results["cpu_time"] = time.process_time() - cpu_start
+    # ru_maxrss is in kilobytes on Linux
+    results["peak_memory_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results["discord_calls_per_minute"] = discord_stats["requests"] / minutes
+    results["discord_429s"] = discord_stats["retries"]
+    results["hockeydata_calls_per_minute"] = sum(hockeydata_stats.values()) / minutes
+    results["response_cache_hit_ratio"] = api_handler.responses.hit_ratio
+
+    await client.close()
+    return results
+
+
+def run_bot(channels: int, goals: int, hockeydata_url: str, discord_url: str) -> dict:
+    """Run `drive` in a fresh process, so memory and imports of earlier runs don't count"""
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(DISC_DIRECTORY),
+            "DISCORD_TOKEN": "benchmark",
+            "HOCKEYDATA_HOST": hockeydata_url,
+            "HOCKEYDATA_API_KEY": "benchmark",
+            "HOCKEYDATA_STREAM_URL": "",
+            "HOCKEYDATA_TEAM_NAME": HOME,
+            "DISPLAYED_TEAM_NAME": HOME,
+            "TEAMS_FILE": "",
+            "ROLE": "all",
+            "SHARD_COUNT": "",
+            "SHARD_IDS": "",
+        }
+        command = [sys.executable, __file__, "--drive", str(channels), str(goals), hockeydata_url, discord_url]
+        # Runs in an empty directory, so the bot doesn't read .env or the data of a real deployment
+        process = subprocess.run(command, cwd=directory, env=env, stdout=subprocess.PIPE, check=True, text=True)
+    *output, result = process.stdout.splitlines()
+    # Anything the bot printed (like failed sends) comes before the result
+    for line in output:
+        print(line, file=sys.stderr)
+    return json.loads(result)
+
+
+async def run_benchmark(args: argparse.Namespace) -> list[dict]:
+    results = []
+    for channels in args.channels:
+        hockeydata_app = create_hockeydata_app(HOME, AWAY)
+
+        async def hockeydata_stats(request: web.Request, app: web.Application = hockeydata_app) -> web.Response:
+            requests = app["match"].requests
+            return web.json_response({path: count for path, count in requests.items() if not path.startswith("/bench")})
+
+        hockeydata_app.router.add_get("/bench/stats", hockeydata_stats)
+        fake_discord = FakeDiscord(args.latency, args.jitter, args.rate_limited)
+        hockeydata_runner, hockeydata_url = await _start(hockeydata_app)
+        discord_runner, discord_url = await _start(fake_discord.create_app())
+        try:
+            print(f"Running with {channels} channels...", file=sys.stderr)
+            result = await asyncio.to_thread(run_bot, channels, args.goals, hockeydata_url, discord_url)
+        finally:
+            await hockeydata_runner.cleanup()
+            await discord_runner.cleanup()
+        results.append(result)
+    return results
+
+
+def _summary(result: dict) -> dict:
+    """Flatten a result into one number per metric"""
+    return {
+        "start_first": result["start_first"],
+        "start_last": result["start_last"],
+        "goal_first": max(result["goal_first"], default=None),
+        "goal_last": max(result["goal_last"], default=None),
+        "cpu_time": result["cpu_time"],
+        "peak_memory_mb": result["peak_memory_mb"],
+        "discord_calls_per_minute": result["discord_calls_per_minute"],
+        "hockeydata_calls_per_minute": result["hockeydata_calls_per_minute"],
+    }
+
+
+def print_results(results: list[dict], baseline: list[dict] = None, threshold: float = 0.1) -> bool:
+    """Print every metric (and its change against the baseline), returns whether anything got worse"""
+    baseline = {result["channels"]: _summary(result) for result in baseline or []}
+    regressed = False
+    for result in results:
+        print(f"\n{result['channels']} channels")
+        before = baseline.get(result["channels"], {})
+        for metric, value in _summary(result).items():
+            line = f"  {metric:28} {value:10.3f}" if value is not None else f"  {metric:28} {'-':>10}"
+            if before.get(metric) and value is not None:
+                change = (value - before[metric]) / before[metric]
+                worse = metric in METRICS and change > threshold
+                regressed |= worse
+                line += f"  {change:+7.1%}{'  !' if worse else ''}"
+            print(line)
+    return regressed
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "--drive":
+        channels, goals, hockeydata_url, discord_url = sys.argv[2:]
+        result = asyncio.run(drive(int(channels), int(goals), hockeydata_url, discord_url))
+        print(json.dumps(result))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=int, nargs="+", default=[10, 100, 10000])
+    parser.add_argument("--goals", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the fake Discord API takes to answer")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--rate-limited", type=float, default=0.01, help="share of sends answered with a 429")
+    parser.add_argument("--output", type=Path, help="save the results to this json file")
+    parser.add_argument("--compare", type=Path, help="compare with the results saved by an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        run = {"created": datetime.now(tz=UTC).isoformat(), "arguments": vars(args) | {"output": None, "compare": None}}
+        args.output.write_text(json.dumps(run | {"results": results}, indent=2, default=str))
+
+    baseline = json.loads(args.compare.read_text())["results"] if args.compare else None
+    if print_results(results, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
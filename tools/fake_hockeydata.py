@@ -0,0 +1,181 @@
+"""Stand-in HockeyData server for running the bot offline.
+
+Serves the live and media endpoints the bot polls, and a Server-Sent Events feed of the live payloads on
+/live/stream. The match is driven with POST /control/{start,end,goal/home,goal/away}, or automatically with
+--goal-every.
+
+    python tools/fake_hockeydata.py --port 8080 --goal-every 30
+    HOCKEYDATA_HOST=http://localhost:8080 HOCKEYDATA_STREAM_URL=http://localhost:8080/live/stream python main.py
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta, UTC
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+
+class FakeMatch:
+    def __init__(self, home: str, away: str) -> None:
+        self.match = {
+            "status": "Scheduled",
+            "date": (datetime.now(tz=UTC) + timedelta(minutes=5)).isoformat(),
+            "homeTeam": {"fullName": home},
+            "awayTeam": {"fullName": away},
+            "venue": {"name": "Fake Arena"},
+            "tournament": {"name": "Fake League"},
+        }
+        self.score = {"homeTeam": {"team": home, "score": 0}, "awayTeam": {"team": away, "score": 0}}
+        self.scorer = None
+        # Every change is kept as a stream event, so reconnecting clients can resume where they left off
+        self.events: list[tuple[int, str, dict]] = []
+        self.changed = asyncio.Condition()
+        self.requests: dict[str, int] = {}
+
+    async def _publish(self, event: str, data: dict) -> None:
+        async with self.changed:
+            self.events.append((len(self.events) + 1, event, json.loads(json.dumps(data))))
+            self.changed.notify_all()
+
+    async def set_status(self, status: str) -> None:
+        self.match["status"] = status
+        if status == "InProgress":
+            self.score["homeTeam"]["score"] = self.score["awayTeam"]["score"] = 0
+        await self._publish("match", self.match)
+
+    async def goal(self, side: str) -> None:
+        team = self.score[f"{side}Team"]
+        team["score"] += 1
+        player_id = 10 + team["score"]
+        self.scorer = {
+            "playerinfo": {
+                "scorer": {"id": player_id, "fullName": f"Player {player_id}", "jerseyNumber": player_id},
+                "assists": [{"fullName": "Assisting Player", "jerseyNumber": 99}],
+            }
+        }
+        await self._publish("score", self.score)
+
+
+def _image(color: tuple[int, int, int], size: int = 1000) -> bytes:
+    with BytesIO() as output:
+        Image.new("RGB", (size, size), color).save(output, format="png")
+        return output.getvalue()
+
+
+def _json_response(request: web.Request, data: dict) -> web.Response:
+    body = json.dumps(data).encode()
+    etag = f'"{hashlib.md5(body).hexdigest()}"'
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers={"ETag": etag})
+    return web.Response(body=body, content_type="application/json", headers={"ETag": etag})
+
+
+def create_app(home: str, away: str) -> web.Application:
+    app = web.Application()
+    match = app["match"] = FakeMatch(home, away)
+    team_image, player_image = _image((200, 30, 30)), _image((30, 30, 200), size=800)
+
+    @web.middleware
+    async def count_requests(request: web.Request, handler):
+        match.requests[request.path] = match.requests.get(request.path, 0) + 1
+        return await handler(request)
+
+    app.middlewares.append(count_requests)
+
+    async def live_match(request: web.Request) -> web.Response:
+        return _json_response(request, match.match)
+
+    async def live_score(request: web.Request) -> web.Response:
+        return _json_response(request, match.score)
+
+    async def goal_scorer(request: web.Request) -> web.Response:
+        if not match.scorer:
+            raise web.HTTPNotFound()
+        return _json_response(request, match.scorer)
+
+    async def image(request: web.Request) -> web.Response:
+        data = player_image if request.path.startswith("/media/player") else team_image
+        return web.Response(body=data, content_type="image/png", headers={"ETag": f'"{len(data)}"'})
+
+    async def stream(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(event_id: int, event: str, data: dict) -> None:
+            await response.write(f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n".encode())
+
+        last_id = int(request.headers.get("Last-Event-ID") or 0)
+        if not last_id:
+            # New clients get the current state first
+            await send(len(match.events), "match", match.match)
+            await send(len(match.events), "score", match.score)
+            last_id = len(match.events)
+
+        while True:
+            for event_id, event, data in match.events[last_id:]:
+                await send(event_id, event, data)
+                last_id = event_id
+            async with match.changed:
+                try:
+                    await asyncio.wait_for(match.changed.wait(), timeout=15)
+                except asyncio.TimeoutError:
+                    await response.write(b": keep-alive\n\n")
+
+    async def control(request: web.Request) -> web.Response:
+        action = request.match_info["action"]
+        if action == "start":
+            await match.set_status("InProgress")
+        elif action == "end":
+            await match.set_status("Finished")
+        elif action in ("goal/home", "goal/away"):
+            await match.goal(action.removeprefix("goal/"))
+        else:
+            raise web.HTTPNotFound()
+        return web.json_response({"match": match.match, "score": match.score})
+
+    app.router.add_get("/live/match", live_match)
+    app.router.add_get("/live/score", live_score)
+    app.router.add_get("/live/recent-goal-scorer-stats", goal_scorer)
+    app.router.add_get("/live/stream", stream)
+    app.router.add_get("/media/player/{player_id}", image)
+    app.router.add_get("/media/team/search/logo/{team_name}", image)
+    app.router.add_post(r"/control/{action:.+}", control)
+    return app
+
+
+async def play(match: FakeMatch, goal_every: float) -> None:
+    """Start the match and let the teams score in turns"""
+    await match.set_status("InProgress")
+    side = "home"
+    while True:
+        await asyncio.sleep(goal_every)
+        await match.goal(side)
+        side = "away" if side == "home" else "home"
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--home", default="Home Team")
+    parser.add_argument("--away", default="Away Team")
+    parser.add_argument("--goal-every", type=float, help="start the match and score every N seconds")
+    args = parser.parse_args()
+
+    app = create_app(args.home, args.away)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"Fake HockeyData running on http://{args.host}:{args.port}")
+
+    if args.goal_every:
+        await play(app["match"], args.goal_every)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,269 @@
+"""Replay recorded matches through the poller, to check goal detection and polling offline.
+
+Record matches by running the bot (or the poller) with HOCKEYDATA_RECORD_FILE set, then replay them:
+
+    python tools/replay.py recordings/*.jsonl --speed 10
+    python tools/replay.py recordings/*.jsonl --output replays/main.json
+    python tools/replay.py recordings/*.jsonl --compare replays/main.json
+
+Every recording is replayed in a fresh process on a simulated clock, starting at its first response. The poller runs
+its normal updates (get_match_status, get_goals and _get_scorer_info) and scheduling, and every request is answered
+with the newest recorded response of the endpoint at that moment. --speed 1 replays in real time, --speed 10 ten
+times faster and --speed max (the default) without waiting at all.
+
+For every goal in the recording it reports how long after it appeared in a response it was detected, goals that were
+never detected or detected twice, and the CPU time per hour of match. A recording should cover a single match.
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, UTC
+from pathlib import Path
+
+DISC_DIRECTORY = Path(__file__).resolve().parent.parent / "disc"
+# Metrics where a higher value is worse, used to flag regressions when comparing runs
+METRICS = ("latency_mean", "latency_max", "missed", "duplicated", "cpu_per_match_hour")
+# Responses recorded this close after each other were fetched by the same poll, and are replayed together
+POLL_WINDOW = 0.5
+
+
+class SimulatedClock:
+    """Stands in for the time module of the modules on the hot path, so a match can be replayed faster than it was
+    played. Durations measured with perf_counter (the metrics) still use the real clock."""
+
+    perf_counter = staticmethod(time.perf_counter)
+
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def _group_polls(records: list[dict]) -> None:
+    """Set "poll" of every record to the time of the poll that fetched it, so a poll replayed at that time sees
+    the images and scorer it fetched after the score as well"""
+    poll = previous = None
+    for record in records:
+        if previous is None or record["t"] - previous > POLL_WINDOW:
+            poll = record["t"]
+        record["poll"] = poll
+        previous = record["t"]
+
+
+def _replay_client(records: list[dict], clock: SimulatedClock):
+    import aiohttp
+
+    from hockeydata import HockeyDataClient, HockeyDataResponse
+
+    class ReplayClient(HockeyDataClient):
+        """Answers every request with the newest recorded response of the endpoint at the time of the clock"""
+
+        def __init__(self) -> None:
+            super().__init__()
+            self.requests = 0
+            # Only responses with a body (or a failure) are replayed, 304s mean the previous body is still current
+            self._timelines: dict[str, tuple[list[float], list[dict]]] = {}
+            for record in records:
+                if record.get("status") == 200 or "error" in record:
+                    times, timeline = self._timelines.setdefault(record["endpoint"], ([], []))
+                    times.append(record["poll"])
+                    timeline.append(record)
+
+        async def fetch(self, endpoint: str, api_key: str, etag=None, last_modified=None) -> HockeyDataResponse:
+            self.requests += 1
+            times, timeline = self._timelines.get(endpoint, ([], []))
+            index = bisect.bisect_right(times, clock.now) - 1
+            if index < 0:
+                raise aiohttp.ClientConnectionError(f"{endpoint} wasn't recorded yet")
+            record = timeline[index]
+            if "error" in record:
+                raise aiohttp.ClientConnectionError(f"{endpoint} failed when recorded: {record['error']}")
+            return HockeyDataResponse(status=200, body=record["body"])
+
+    return ReplayClient()
+
+
+def recorded_goals(meta: dict, records: list[dict]) -> dict[tuple[str, str, int], float]:
+    """Every goal in the recording as (team, side, score after the goal), with when it first appeared"""
+    from manifest import ENDPOINTS
+
+    goals = {}
+    for team in meta["teams"]:
+        endpoint = ENDPOINTS["score"].format(host=team["host"])
+        scores = {"team": 0, "opponent": 0}
+        for record in records:
+            if record["endpoint"] != endpoint or record.get("status") != 200:
+                continue
+            try:
+                score = json.loads(record["body"])
+                is_home = score["homeTeam"]["team"] in team["hockeydata_names"]
+                current = {
+                    "team": int(score["homeTeam" if is_home else "awayTeam"]["score"]),
+                    "opponent": int(score["awayTeam" if is_home else "homeTeam"]["score"]),
+                }
+            except (ValueError, KeyError, TypeError):
+                continue
+            for side, value in current.items():
+                for n in range(scores[side] + 1, value + 1):
+                    goals[(team["key"], side, n)] = record["poll"]
+                scores[side] = max(scores[side], value)
+    return goals
+
+
+async def play(path: str, speed: float) -> dict:
+    """Replay a recording in this process, `speed` times faster than real time (0 doesn't wait at all)"""
+    import recorder
+
+    meta, records = recorder.load(path)
+    records.sort(key=lambda record: record["t"])
+    _group_polls(records)
+    start = records[0]["t"]
+    clock = SimulatedClock(start)
+
+    import api_handler
+    import cache
+    import image_cache
+    import match_state
+    import poller
+    import scheduler
+
+    for module in (api_handler, cache, image_cache, match_state, poller, scheduler):
+        module.time = clock
+    api_handler.client = client = _replay_client(records, clock)
+
+    detected: list[tuple[tuple[str, str, int], float]] = []
+
+    async def send_embed(team, disc_embed) -> None:
+        if disc_embed.title_key in ("goal_home_title", "goal_away_title"):
+            side = "team" if disc_embed.title_key == "goal_home_title" else "opponent"
+            n = disc_embed.values[f"{side}_score"]
+            detected.append(((team.key, side, int(n)), clock.now))
+
+    async def ignore(*args) -> None:
+        pass
+
+    match_poller = poller.Poller(send_embed, ignore, ignore)
+    polls = 0
+    end = records[-1]["t"]
+    cpu_start, wall_start = time.process_time(), time.monotonic()
+    while clock.now <= end:
+        await match_poller._update()
+        polls += 1
+        if clock.now >= end:
+            break
+        # The last poll is at the last recorded response, instead of waiting out a long interval past the recording
+        delay = min(*(match_poller.next_delay(team) for team in poller.TEAMS.values()), end - clock.now)
+        # Let background work like preparing images run, even when not waiting
+        await asyncio.sleep(delay / speed if speed else 0)
+        clock.now += delay
+    cpu_time = time.process_time() - cpu_start
+
+    goals = recorded_goals(meta, records)
+    first_detection = {}
+    for key, detected_at in detected:
+        first_detection.setdefault(key, detected_at)
+    latencies = [first_detection[key] - appeared for key, appeared in goals.items() if key in first_detection]
+    match_hours = (end - start) / 3600
+    return {
+        "recording": path,
+        "goals": len(goals),
+        "detected": len(first_detection),
+        "missed": len(goals.keys() - first_detection.keys()),
+        "duplicated": len(detected) - len(first_detection),
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+        "latency_max": max(latencies, default=None),
+        "polls": polls,
+        "hockeydata_requests": client.requests,
+        "match_hours": match_hours,
+        "cpu_time": cpu_time,
+        "cpu_per_match_hour": cpu_time / match_hours if match_hours else None,
+        "wall_time": time.monotonic() - wall_start,
+    }
+
+
+def run_replay(path: Path, speed: float) -> dict:
+    """Run `play` in a fresh process, with the teams of the recording and an empty data directory"""
+    with open(path, encoding="utf-8") as f:
+        meta = json.loads(f.readline())["meta"]
+    with tempfile.TemporaryDirectory() as directory:
+        teams_file = os.path.join(directory, "teams.json")
+        with open(teams_file, "w", encoding="utf-8") as f:
+            json.dump(meta["teams"], f)
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(DISC_DIRECTORY),
+            "TEAMS_FILE": teams_file,
+            "HOCKEYDATA_API_KEY": "replay",
+            "HOCKEYDATA_RECORD_FILE": "",
+            "METRICS_TRACE_FILE": "",
+        }
+        command = [sys.executable, __file__, "--play", str(path.resolve()), str(speed)]
+        process = subprocess.run(command, cwd=directory, env=env, stdout=subprocess.PIPE, check=True, text=True)
+    *output, result = process.stdout.splitlines()
+    # Anything the poller printed (like failed requests) comes before the result
+    for line in output:
+        print(line, file=sys.stderr)
+    return json.loads(result)
+
+
+def print_results(results: list[dict], baseline: list[dict] = None, threshold: float = 0.1) -> bool:
+    """Print every metric (and its change against the baseline), returns whether anything got worse"""
+    baseline = {result["recording"]: result for result in baseline or []}
+    regressed = False
+    for result in results:
+        print(f"\n{result['recording']}")
+        before = baseline.get(result["recording"], {})
+        for metric, value in result.items():
+            if metric == "recording":
+                continue
+            line = f"  {metric:22} {value:10.3f}" if value is not None else f"  {metric:22} {'-':>10}"
+            if metric in METRICS and value is not None and before.get(metric) is not None:
+                worse = value > before[metric] * (1 + threshold) and value - before[metric] > 1e-9
+                regressed |= worse
+                line += f"  was {before[metric]:10.3f}{'  !' if worse else ''}"
+            print(line)
+    return regressed
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "--play":
+        path, speed = sys.argv[2:]
+        print(json.dumps(asyncio.run(play(path, float(speed)))))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", type=Path, nargs="+")
+    parser.add_argument("--speed", default="max", help="1 for real time, 10 for ten times faster or max")
+    parser.add_argument("--output", type=Path, help="save the results to this json file")
+    parser.add_argument("--compare", type=Path, help="compare with the results saved by an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+    speed = 0 if args.speed == "max" else float(args.speed)
+
+    results = []
+    for path in args.recordings:
+        print(f"Replaying {path}...", file=sys.stderr)
+        results.append(run_replay(path, speed))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        run = {"created": datetime.now(tz=UTC).isoformat(), "speed": args.speed}
+        args.output.write_text(json.dumps(run | {"results": results}, indent=2, default=str))
+
+    baseline = json.loads(args.compare.read_text())["results"] if args.compare else None
+    if print_results(results, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()